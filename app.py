@@ -1,17 +1,14 @@
-import os 
-import streamlit as st 
-
-
 # Custom Imports 
 from multipage import Multipage 
-from pages import overall, your_performance # import all pages 
 
 # Create instance of app 
 app = Multipage()
 
-app.add_page("Overall Data", overall.app)
-app.add_page("My Performance", your_performance.app)
+# pages are given as module paths and only imported when first selected
+app.add_page("Overall Data", "pages.overall")
+app.add_page("My Performance", "pages.your_performance")
+app.add_page("League Analytics", "pages.league")
 
 
 # Main application
-app.run()
\ No newline at end of file
+app.run()
@@ -2,7 +2,29 @@
 This file contains the framework for generating the multi page Streamlit FPL application
 through an OOP structure.
 """
-import streamlit as st 
+import time
+import importlib
+import streamlit as st
+from pages import metrics
+
+# seconds spent importing each page module, kept for the life of the process
+import_times = dict()
+
+
+def load_page(path):
+
+	""" Imports a page given as 'package.module' or 'package.module:function' and returns its function,
+	which defaults to app. The import time of each module is recorded the first time it is loaded. """
+	module_name, _, func_name = path.partition(':')
+
+	if module_name not in import_times:
+		start = time.perf_counter()
+		importlib.import_module(module_name)
+		import_times[module_name] = time.perf_counter() - start
+		metrics.registry.add('page_import_seconds', import_times[module_name], (('module', module_name),))
+
+	return getattr(importlib.import_module(module_name), func_name or 'app')
+
 
 class Multipage:
 
@@ -12,16 +34,37 @@ class Multipage:
 
 	def add_page(self, title, func) -> None:
 
+		""" Adds a page given either as a function or as a module path, such as 'pages.overall', that is
+		only imported when the page is first selected. """
 		self.pages.append({
 			"title": title,
 			"func":func
 			})
 
+	def import_report(self):
+
+		""" Returns the seconds spent importing each lazily loaded page module so far. """
+		return {page['title']: import_times.get(page['func'].partition(':')[0])
+			for page in self.pages if isinstance(page['func'], str)}
 
 	def run(self) -> None:
-		page = st.sidebar.selectbox(
+		# pages are chosen by title so the widget's value is a plain string, whichever way the app is driven
+		title = st.sidebar.selectbox(
     		'App Naviagaton',
-    		self.pages,
-    		format_func=lambda page: page['title'])
+    		[page['title'] for page in self.pages])
+		page = next(page for page in self.pages if page['title'] == title)
+
+		func = load_page(page['func']) if isinstance(page['func'], str) else page['func']
+
+		# time the page render and, if enabled, show its measurements in the sidebar
+		metrics.start_metrics_server()
+		try:
+			with metrics.render(page['title']) as recorder:
+				func()
+		finally:
+			if metrics.DEBUG_PANEL:
+				from pages import cache
 
-		page['func']()
\ No newline at end of file
+				metrics.debug_panel(recorder)
+				st.sidebar.write("Page import times (s)", self.import_report())
+				st.sidebar.write("Caches", dict(live=cache.live.stats(), immutable=cache.immutable.stats()))
@@ -0,0 +1,288 @@
+"""
+This file contains the caching helpers shared by the FPL data layer.
+"""
+import os
+import sys
+import time
+import hashlib
+import logging
+import threading
+import functools
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from pages import fpl_client, snapshot_store, metrics
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+# memory budget of the cache of live, per-manager results
+LIVE_CACHE_BYTES = int(os.environ.get('FPL_CACHE_MB', 256)) * MB
+
+# memory budget of the long-lived cache of data that never changes, such as finished gameweeks
+IMMUTABLE_CACHE_BYTES = int(os.environ.get('FPL_IMMUTABLE_CACHE_MB', 256)) * MB
+
+# seconds a live result is served before it is computed again
+LIVE_TTL = 600
+
+MISSING = object()
+
+
+def per_payload(func):
+
+	""" Decorator memoizing func on the identity of its first argument, typically the bootstrap payload.
+	Only the latest payload's results are kept, so derived data is rebuilt once each time the payload is refreshed. """
+	lock = threading.Lock()
+	state = dict(payload=None, results=dict())
+
+	@functools.wraps(func)
+	def wrapper(payload, *args):
+		with lock:
+			if state['payload'] is not payload:
+				state['payload'] = payload
+				state['results'] = dict()
+			results = state['results']
+			if args in results:
+				metrics.cache_hit(func.__name__)
+				return results[args]
+
+		metrics.cache_hit(func.__name__, False)
+		result = func(payload, *args)
+		with lock:
+			if state['payload'] is payload:
+				results[args] = result
+
+		return result
+
+	return wrapper
+
+
+class RevalidatingCache:
+
+	""" Single process-wide copy of an API payload shared by every session. The payload is served fresh for ttl
+	seconds, then served stale while a background thread revalidates it with its ETag/Last-Modified validators.
+	Payloads older than max_stale seconds are refreshed before being returned. If a snapshot store is given,
+	every download is persisted to it and a new process starts from the stored copy. """
+	def __init__(self, path, ttl, max_stale=None, snapshots=None) -> None:
+		self.path = path
+		self.snapshots = snapshots
+		self.ttl = ttl
+		self.max_stale = max_stale if max_stale is not None else 10 * ttl
+		self._value = None
+		self._etag = None
+		self._last_modified = None
+		self._fetched_at = 0
+		self._refreshing = False
+		self._lock = threading.Lock()
+		self._fetch_lock = threading.Lock()
+
+	def get(self):
+
+		""" Returns the cached payload, downloading it on first use. """
+		if self._value is None and self.snapshots is not None:
+			self._load_snapshot()
+
+		with self._lock:
+			age = time.time() - self._fetched_at
+			value = self._value
+			start_refresh = value is not None and self.ttl <= age < self.max_stale and not self._refreshing
+			if start_refresh:
+				self._refreshing = True
+
+		if value is None or age >= self.max_stale:
+			metrics.cache_hit(self.path, False)
+			return self._revalidate()
+
+		metrics.cache_hit(self.path)
+		if start_refresh:
+			threading.Thread(target=self._background_refresh, daemon=True).start()
+
+		return value
+
+	def invalidate(self) -> None:
+
+		""" Marks the payload as expired so the next call revalidates it before returning. """
+		with self._lock:
+			self._fetched_at = 0
+
+	def _load_snapshot(self) -> None:
+
+		""" Seeds the cache with the stored copy of the payload, keeping its original download time. """
+		entry = self.snapshots.entry(self.path)
+		with self._lock:
+			if entry is not None and self._value is None:
+				self._value, self._fetched_at = entry[0], entry[1]
+
+	def _revalidate(self):
+
+		""" Conditionally re-fetches the payload, keeping the current object when it has not changed. """
+		with self._fetch_lock:
+			with self._lock:
+				# another caller may have refreshed the payload while we waited for the fetch lock
+				if self._value is not None and time.time() - self._fetched_at < self.ttl:
+					return self._value
+				etag, last_modified = (self._etag, self._last_modified) if self._value is not None else (None, None)
+
+			data, etag, last_modified = fpl_client.get_json_if_modified(self.path, etag, last_modified)
+
+			if data is not None and self.snapshots is not None:
+				self.snapshots.put(self.path, data, ttl=snapshot_store.PERMANENT)
+
+			with self._lock:
+				if data is not None:
+					self._value = data
+				self._etag = etag
+				self._last_modified = last_modified
+				self._fetched_at = time.time()
+				return self._value
+
+	def _background_refresh(self) -> None:
+		try:
+			self._revalidate()
+		except fpl_client.FPLAPIError as e:
+			logger.warning("Background refresh of %s failed, serving stale data: %s", self.path, e)
+		finally:
+			with self._lock:
+				self._refreshing = False
+
+
+def sizeof(value, _seen=None):
+
+	""" Returns an estimate of the bytes held by value, counting data frames, arrays, containers and the
+	attributes of plain objects. Objects reachable more than once are counted once. """
+	_seen = set() if _seen is None else _seen
+	if id(value) in _seen:
+		return 0
+	_seen.add(id(value))
+
+	if isinstance(value, pd.DataFrame):
+		return int(value.memory_usage(index=True, deep=True).sum())
+	if isinstance(value, (pd.Series, pd.Index)):
+		return int(value.memory_usage(deep=True))
+	if isinstance(value, np.ndarray):
+		return value.nbytes + sys.getsizeof(value) * (value.base is None)
+	if isinstance(value, dict):
+		return sys.getsizeof(value) + sum(sizeof(k, _seen) + sizeof(v, _seen) for k, v in value.items())
+	if isinstance(value, (list, tuple, set, frozenset)):
+		return sys.getsizeof(value) + sum(sizeof(item, _seen) for item in value)
+	if hasattr(value, '__dict__') and not isinstance(value, type):
+		return sys.getsizeof(value) + sizeof(vars(value), _seen)
+
+	return sys.getsizeof(value)
+
+
+def fingerprint(value):
+
+	""" Returns a hashable key for value. Hashable values are used as they are, so objects compare by identity;
+	data frames and arrays are keyed by a digest of their contents and containers by the keys of their items. """
+	if isinstance(value, (pd.DataFrame, pd.Series)):
+		digest = hashlib.blake2b(digest_size=16)
+		digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+		digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+		return ('frame', digest.hexdigest())
+	if isinstance(value, np.ndarray):
+		return ('array', str(value.dtype), value.shape, hashlib.blake2b(np.ascontiguousarray(value).tobytes(), digest_size=16).hexdigest())
+	if isinstance(value, dict):
+		return ('dict',) + tuple((fingerprint(key), fingerprint(item)) for key, item in value.items())
+	if isinstance(value, (list, tuple)):
+		return (type(value).__name__,) + tuple(fingerprint(item) for item in value)
+
+	return value
+
+
+class MemoryCache:
+
+	""" Least recently used cache bounded by an estimate of the bytes it holds, with an optional expiry per entry.
+	Hits, misses, evictions and the bytes held are reported under name. """
+	def __init__(self, name, max_bytes, ttl=None) -> None:
+		self.name = name
+		self.max_bytes = max_bytes
+		self.ttl = ttl
+		self.bytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._entries = OrderedDict()
+		self._lock = threading.Lock()
+
+	def __len__(self):
+		return len(self._entries)
+
+	def get(self, key):
+
+		""" Returns the value stored under key, or MISSING if there is none or it has expired. """
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is not None and entry[2] is not None and entry[2] <= time.time():
+				self._remove(key)
+				entry = None
+
+			if entry is None:
+				self.misses += 1
+			else:
+				self._entries.move_to_end(key)
+				self.hits += 1
+
+		metrics.cache_hit(self.name, entry is not None)
+		return MISSING if entry is None else entry[0]
+
+	def put(self, key, value, ttl=MISSING) -> None:
+
+		""" Stores value under key, expiring after ttl seconds (default the cache's ttl, None never), then evicts the
+		least recently used entries until the cache is within its budget. A value larger than the budget is not stored. """
+		ttl = self.ttl if ttl is MISSING else ttl
+		size = sizeof(value)
+		evicted = 0
+		with self._lock:
+			if key in self._entries:
+				self._remove(key)
+			if size <= self.max_bytes:
+				self._entries[key] = (value, size, None if ttl is None else time.time() + ttl)
+				self.bytes += size
+			while self.bytes > self.max_bytes:
+				self._remove(next(iter(self._entries)))
+				evicted += 1
+			self.evictions += evicted
+			held = self.bytes
+
+		if evicted:
+			metrics.count('cache_evictions_total', evicted, cache=self.name)
+		metrics.gauge('cache_bytes', held, cache=self.name)
+
+	def _remove(self, key) -> None:
+		self.bytes -= self._entries.pop(key)[1]
+
+	def clear(self) -> None:
+		with self._lock:
+			self._entries.clear()
+			self.bytes = 0
+
+	def stats(self):
+		with self._lock:
+			return dict(entries=len(self._entries), bytes=self.bytes, max_bytes=self.max_bytes,
+				hits=self.hits, misses=self.misses, evictions=self.evictions)
+
+
+live = MemoryCache('live', LIVE_CACHE_BYTES, ttl=LIVE_TTL)
+immutable = MemoryCache('immutable', IMMUTABLE_CACHE_BYTES)
+
+
+def memoize(store, ttl=MISSING):
+
+	""" Decorator caching func's results in store, keyed by its name and the fingerprint of its arguments. Results
+	are shared by every session and must not be mutated by callers. """
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			key = (func.__module__, func.__qualname__, fingerprint(args), fingerprint(tuple(sorted(kwargs.items()))))
+			result = store.get(key)
+			if result is MISSING:
+				result = func(*args, **kwargs)
+				store.put(key, result, ttl)
+			return result
+
+		wrapper.cache = store
+		return wrapper
+
+	return decorator
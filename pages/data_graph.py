@@ -0,0 +1,135 @@
+"""
+This file contains the data graph used by pages to start all of their fetches up front. Each task runs on a
+thread pool as soon as the tasks it depends on have finished, and the page renders each section as soon as
+the data it needs has arrived, so time to first content is bounded by the slowest single request rather than
+the sum of all of them. Streams are tasks yielding items one at a time, which pages show as they arrive.
+"""
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pages import metrics
+
+MAX_WORKERS = 8
+
+
+def _script_context():
+
+	""" Returns a function attaching the caller's Streamlit script context to the current thread, so cached
+	functions can be called from worker threads. Does nothing outside a Streamlit script. """
+	try:
+		from streamlit.runtime.scriptrunner import get_script_run_ctx, add_script_run_ctx
+	except ImportError:
+		try:
+			from streamlit.report_thread import get_report_ctx as get_script_run_ctx, add_report_ctx as add_script_run_ctx
+		except ImportError:
+			return lambda: None
+
+	ctx = get_script_run_ctx()
+	if ctx is None:
+		return lambda: None
+
+	return lambda: add_script_run_ctx(threading.current_thread(), ctx)
+
+
+class DataGraph:
+
+	""" Named tasks run concurrently in dependency order. Dependencies must be added before the tasks that use them,
+	which guarantees a task never waits on a dependency that has not started. """
+
+	# item passed for a stream once it has finished
+	END = object()
+
+	def __init__(self, max_workers=MAX_WORKERS) -> None:
+		self._executor = ThreadPoolExecutor(max_workers=max_workers)
+		self._futures = dict()
+		# (stream, item) pairs, (stream, END) once a stream stops, and None each time a task finishes
+		self._events = queue.Queue()
+		self._attach_context = _script_context()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self._executor.shutdown(wait=False)
+		return False
+
+	def _submit(self, name, run):
+
+		""" Starts run on the pool as task name, posting None to the events once it finishes. """
+		self._futures[name] = self._executor.submit(metrics.propagate(run))
+		self._futures[name].add_done_callback(lambda _: self._events.put(None))
+		return self._futures[name]
+
+	def add(self, name, func, *dependencies):
+
+		""" Starts func as task name. It is called with the results of its dependencies, in order, once they finish. """
+		inputs = [self._futures[dependency] for dependency in dependencies]
+
+		def run():
+			self._attach_context()
+			return func(*[future.result() for future in inputs])
+
+		return self._submit(name, run)
+
+	def stream(self, name, func, *dependencies):
+
+		""" Starts generator function func as task name, called like the function of add. Each item it yields is passed
+		on by updates as soon as it is made; the result of the task is the number of items. """
+		inputs = [self._futures[dependency] for dependency in dependencies]
+
+		def run():
+			try:
+				self._attach_context()
+				count = 0
+				for item in func(*[future.result() for future in inputs]):
+					self._events.put((name, item))
+					count += 1
+				return count
+			finally:
+				# posted after every item, even if a dependency or func failed, and ends the stream for updates
+				self._events.put((name, self.END))
+
+		return self._submit(name, run)
+
+	def result(self, name):
+
+		""" Returns the result of a task, waiting for it if needed, and raises its error if it failed. """
+		return self._futures[name].result()
+
+	def ready(self, sections):
+
+		""" Yields the names of sections, given as a dict of section name to the tasks it needs, as soon as all of
+		their tasks have finished. """
+		for name, _ in self.updates(sections):
+			yield name
+
+	def updates(self, sections, streams=()):
+
+		""" Yields (section, None) for each of sections, given as a dict of section name to the tasks it needs, as soon as all
+		of their tasks have finished, (stream, item) for each item the given streams yield and (stream, END) once a stream
+		has finished, when its result holds its error if it failed. A section whose tasks include all of a stream's
+		dependencies is yielded before that stream's items. """
+		pending = dict(sections)
+		streaming = set(streams)
+		events = list()
+		while True:
+			while True:
+				try:
+					events.append(self._events.get_nowait())
+				except queue.Empty:
+					break
+
+			for name, tasks in list(pending.items()):
+				if all(self._futures[task].done() for task in tasks):
+					del pending[name]
+					yield name, None
+
+			for event in events:
+				if event is not None and event[0] in streaming:
+					if event[1] is self.END:
+						streaming.discard(event[0])
+					yield event
+
+			if not pending and not streaming:
+				return
+			events = [self._events.get()]
@@ -0,0 +1,76 @@
+"""
+This file contains the element index used to resolve player ids to their names, positions, teams and costs.
+The index is built once per bootstrap payload and resolves whole arrays of ids in a single vectorized lookup.
+"""
+import numpy as np
+import pandas as pd
+from pages import cache, metrics
+
+
+class ElementIndex:
+
+	""" Id-indexed arrays of element attributes built from the bootstrap 'elements' list. """
+	def __init__(self, elements, element_types=(), teams=()) -> None:
+		elements = pd.DataFrame(elements)
+		ids = elements['id'].to_numpy()
+
+		# maps an element id to its row, -1 for ids not in the payload
+		self._rows = np.full(ids.max() + 1 if len(ids) else 1, -1)
+		self._rows[ids] = np.arange(len(ids))
+
+		self.web_name = elements['web_name'].to_numpy(dtype=object)
+		self.element_type = elements['element_type'].to_numpy()
+		self.team = elements['team'].to_numpy()
+		self.now_cost = elements['now_cost'].to_numpy() / 10
+
+		self._position_names = {element_type['id']: element_type['singular_name_short'] for element_type in element_types}
+		self._team_names = {team['id']: team['short_name'] for team in teams}
+
+	def rows(self, ids):
+
+		""" Returns the row of each element id, raising KeyError for ids not in the index. """
+		ids = np.asarray(ids, dtype=np.int64)
+		valid = (ids >= 0) & (ids < len(self._rows))
+		rows = np.where(valid, self._rows[np.where(valid, ids, 0)], -1)
+		if (rows < 0).any():
+			raise KeyError(f"Unknown element ids: {ids[rows < 0].tolist()}")
+
+		return rows
+
+	def names(self, ids):
+		return self.web_name[self.rows(ids)]
+
+	def positions(self, ids):
+		return self.element_type[self.rows(ids)]
+
+	def position_names(self, ids):
+		return np.array([self._position_names.get(position, '') for position in self.positions(ids)], dtype=object)
+
+	def teams(self, ids):
+		return self.team[self.rows(ids)]
+
+	def team_names(self, ids):
+		return np.array([self._team_names.get(team, '') for team in self.teams(ids)], dtype=object)
+
+	def costs(self, ids):
+		return self.now_cost[self.rows(ids)]
+
+	def frame(self, ids):
+
+		""" Returns a data frame with the name, position, team and cost of each element id. """
+		rows = self.rows(ids)
+		return pd.DataFrame(dict(
+			id=np.asarray(ids),
+			web_name=self.web_name[rows],
+			element_type=self.element_type[rows],
+			team=self.team[rows],
+			now_cost=self.now_cost[rows]))
+
+
+@cache.per_payload
+@metrics.timer('element_index', 'transform')
+def element_index(base_data):
+
+	""" Returns the ElementIndex of a bootstrap payload, building it only the first time the payload is seen. """
+
+	return ElementIndex(base_data['elements'], base_data.get('element_types', ()), base_data.get('teams', ()))
@@ -0,0 +1,133 @@
+"""
+This file contains the figure cache. Figures are serialized once into compact JSON, keyed by the name of the
+chart and a hash of its input data, and displayed from that JSON so a figure whose inputs have not changed is
+neither rebuilt nor serialized again on each rerun.
+"""
+import json
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from pages import metrics, cache
+
+# plotly config Streamlit sends with every chart
+CHART_CONFIG = json.dumps(dict(showLink=False, linkText=False))
+
+# decimal places kept for floats in serialized figures
+FLOAT_PRECISION = 3
+
+# number of serialized figures kept by the figure cache
+MAX_FIGURES = 1024
+
+
+def _compact(value, precision):
+
+	""" Returns value with NumPy arrays turned into lists, floats rounded to precision and whole floats stored as ints. """
+	if isinstance(value, dict):
+		return {key: _compact(item, precision) for key, item in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [_compact(item, precision) for item in value]
+	if isinstance(value, (pd.Series, pd.Index)):
+		value = value.to_numpy()
+	if isinstance(value, np.ndarray):
+		if value.dtype.kind == 'f':
+			value = np.round(value, precision)
+			if np.all(np.isnan(value) | (value == np.round(value))):
+				return [None if np.isnan(item) else int(item) for item in value.tolist()]
+			return [None if np.isnan(item) else item for item in value.tolist()]
+		if value.dtype.kind == 'M':
+			return [str(item) for item in value]
+		return _compact(value.tolist(), precision)
+	if isinstance(value, (float, np.floating)):
+		value = round(float(value), precision)
+		return int(value) if value.is_integer() else value
+	if isinstance(value, np.integer):
+		return int(value)
+	if isinstance(value, np.bool_):
+		return bool(value)
+
+	return value
+
+
+def figure_json(fig, precision=FLOAT_PRECISION):
+
+	""" Returns the compact JSON spec of a figure as it is sent to the browser, with floats rounded to precision. """
+	import plotly.utils
+
+	return json.dumps(_compact(fig.to_plotly_json(), precision), cls=plotly.utils.PlotlyJSONEncoder, separators=(',', ':'))
+
+
+def data_hash(*data):
+
+	""" Returns a key for the data frames, series and plain values a figure is built from, the same one the
+	memory caches use. """
+	return cache.fingerprint(data)
+
+
+class FigureCache:
+
+	""" Least recently used cache of serialized figures keyed by chart name and input data hash. """
+	def __init__(self, max_figures=MAX_FIGURES) -> None:
+		self.max_figures = max_figures
+		self._specs = OrderedDict()
+		self._lock = threading.Lock()
+		# plotly's lazily loaded templates are not safe to build figures from on several threads at once
+		self._build_lock = threading.Lock()
+
+	def get_or_build(self, name, data, build):
+
+		""" Returns the JSON spec of the figure build() returns for data, building it only if data changed.
+		If build returns several figures, a tuple of their specs is returned. """
+		key = (name, data_hash(*(data if isinstance(data, tuple) else (data,))))
+		with self._lock:
+			if key in self._specs:
+				self._specs.move_to_end(key)
+				metrics.cache_hit('figures')
+				return self._specs[key]
+
+		metrics.cache_hit('figures', False)
+		spec = self.build(name, build)
+
+		with self._lock:
+			self._specs[key] = spec
+			while len(self._specs) > self.max_figures:
+				self._specs.popitem(last=False)
+
+		return spec
+
+
+	def build(self, name, build):
+
+		""" Returns the JSON spec of the figure build() returns without caching it, or a tuple of specs for several figures. """
+		with self._build_lock, metrics.timer(name, 'chart'):
+			fig = build()
+			return tuple(figure_json(item) for item in fig) if isinstance(fig, (tuple, list)) else figure_json(fig)
+
+
+figure_cache = FigureCache()
+
+
+def plotly_chart(container, spec, use_container_width=False):
+
+	""" Displays a figure in container from its JSON spec. The spec is handed to Streamlit as is; if this Streamlit
+	version does not allow that, the figure is rebuilt from the spec and displayed normally. """
+	try:
+		from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+		enqueue = container._enqueue
+	except (ImportError, AttributeError):
+		import plotly.io
+		return container.plotly_chart(plotly.io.from_json(spec), use_container_width=use_container_width)
+
+	proto = PlotlyChartProto()
+	proto.use_container_width = use_container_width
+	proto.figure.spec = spec
+	proto.figure.config = CHART_CONFIG
+
+	return enqueue('plotly_chart', proto)
+
+
+def cached_chart(container, name, data, build, cached=True):
+
+	""" Displays the figure build() returns for data in container, reusing the cached spec when data is unchanged.
+	Charts shown only once, such as a partial chart while its data arrives, pass cached False and are built each time. """
+	return plotly_chart(container, figure_cache.get_or_build(name, data, build) if cached else figure_cache.build(name, build))
@@ -0,0 +1,294 @@
+"""
+This file contains the shared HTTP client used by every FPL API fetcher. Connections are kept alive
+in a single pooled session and failed requests are retried with bounded, jittered exponential backoff.
+Concurrent requests for the same url share one download, and every request the process sends passes
+through one rate limiter so bursts of sessions never exceed what the API tolerates.
+"""
+import os
+import time
+import random
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+from pages import metrics
+
+# point every fetcher at another server, e.g. the local replay server in tools/replay.py
+BASE_URL = os.environ.get('FPL_API_URL', 'https://fantasy.premierleague.com/api/').rstrip('/') + '/'
+
+# connection pool and concurrency settings
+POOL_SIZE = 16
+MAX_WORKERS = 8
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (3.05, 15)
+
+# retry settings: attempt n waits a random time in [0, min(BACKOFF_CAP, BACKOFF_BASE * 2**n)]
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 8
+RETRY_STATUSES = {429, 500, 502, 504}
+
+# most requests per second the process sends to the API, 0 for no limit, and how many may go out at once
+MAX_RPS = float(os.environ.get('FPL_MAX_RPS', 50))
+BURST = int(os.environ.get('FPL_BURST', 20))
+
+
+class FPLAPIError(Exception):
+
+	""" Raised when the FPL API cannot be reached or returns an unexpected response. """
+	def __init__(self, message, status_code=None, url=None) -> None:
+		super().__init__(message)
+		self.status_code = status_code
+		self.url = url
+
+
+class FPLNotFoundError(FPLAPIError):
+
+	""" Raised when the requested resource does not exist, e.g. an invalid FPL ID or an unplayed gameweek. """
+
+
+class FPLUpdatingError(FPLAPIError):
+
+	""" Raised when the FPL API is unavailable because the game is updating. """
+
+
+class RateLimiter:
+
+	""" Token bucket limiting the requests per second of every thread in the process. Each request takes a token,
+	waiting for one if the bucket is empty; the bucket refills at rate tokens per second up to burst. """
+	def __init__(self, rate=MAX_RPS, burst=BURST) -> None:
+		self._lock = threading.Lock()
+		self.set_rate(rate, burst)
+
+	def set_rate(self, rate, burst=BURST) -> None:
+		with self._lock:
+			self.rate = rate
+			self.burst = max(1, burst)
+			self._tokens = float(self.burst)
+			self._updated = time.monotonic()
+
+	def acquire(self):
+
+		""" Takes a token, sleeping until it is due, and returns the number of seconds waited. Tokens are handed out
+		in the order they are asked for, so a waiting request is never overtaken. """
+		if self.rate <= 0:
+			return 0
+
+		with self._lock:
+			now = time.monotonic()
+			self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate) - 1
+			self._updated = now
+			delay = -self._tokens / self.rate if self._tokens < 0 else 0
+
+		if delay:
+			metrics.count('http_rate_limited_seconds_total', delay)
+			time.sleep(delay)
+
+		return delay
+
+
+limiter = RateLimiter()
+
+
+class SingleFlight:
+
+	""" Coalesces concurrent calls made with the same key: the first caller runs the call and the callers arriving
+	while it is in flight wait for it and share its result or error. """
+	def __init__(self) -> None:
+		self._calls = dict()
+		self._lock = threading.Lock()
+
+	def do(self, key, func):
+		with self._lock:
+			call = self._calls.get(key)
+			leader = call is None
+			if leader:
+				call = self._calls[key] = Future()
+
+		if not leader:
+			metrics.count('http_coalesced_total')
+			return call.result()
+
+		try:
+			call.set_result(func())
+		except Exception as e:
+			call.set_exception(e)
+		except BaseException as e:
+			# an interrupted leader is not the followers' error, but they must never be left waiting
+			call.set_exception(FPLAPIError(f"Request was interrupted: {type(e).__name__}"))
+			raise
+		finally:
+			with self._lock:
+				del self._calls[key]
+
+		return call.result()
+
+
+flights = SingleFlight()
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+
+	""" Returns the process-wide requests session, creating it on first use. """
+	global _session
+
+	if _session is None:
+		with _session_lock:
+			if _session is None:
+				session = requests.Session()
+				adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+				session.mount('https://', adapter)
+				session.mount('http://', adapter)
+				_session = session
+
+	return _session
+
+
+def build_url(path):
+
+	""" Returns the full url for an API path such as 'entry/123/history/'. Full urls are returned unchanged. """
+	if path.startswith('http://') or path.startswith('https://'):
+		return path
+
+	return BASE_URL + path.lstrip('/')
+
+
+def _backoff(attempt, retry_after=None):
+
+	""" Returns the number of seconds to wait before the next attempt. """
+	if retry_after is not None:
+		try:
+			return min(BACKOFF_CAP, float(retry_after))
+		except ValueError:
+			pass
+
+	return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _error_for(response):
+
+	""" Returns the typed error matching a failed response. """
+	url = response.url
+	status = response.status_code
+
+	if status == 503:
+		return FPLUpdatingError("The game is currently updating, please try again at a later time.", status, url)
+	if status == 404:
+		return FPLNotFoundError(f"Response was code {status}.", status, url)
+
+	return FPLAPIError(f"Response was code {status}.", status, url)
+
+
+def _request(path, headers=None, timeout=TIMEOUT, retries=MAX_RETRIES):
+
+	""" Returns the successful (200 or 304) response of an API path, retrying connection errors and transient failures.
+	Callers asking for the same url with the same headers while it is in flight share its response. """
+	url = build_url(path)
+	key = (url, tuple(sorted((headers or {}).items())))
+
+	return flights.do(key, lambda: _send(url, headers, timeout, retries))
+
+
+def _send(url, headers, timeout, retries):
+	session = get_session()
+
+	for attempt in range(retries + 1):
+		retry_after = None
+		if attempt:
+			metrics.count('http_retries_total')
+		limiter.acquire()
+		try:
+			response = session.get(url, headers=headers, timeout=timeout)
+		except (requests.ConnectionError, requests.Timeout) as e:
+			metrics.count('http_requests_total', status='error')
+			error = FPLAPIError(f"Could not reach the FPL API: {e}", url=url)
+		else:
+			metrics.count('http_requests_total', status=response.status_code)
+			metrics.count('http_bytes_total', len(response.content))
+			if response.status_code in (200, 304):
+				return response
+
+			error = _error_for(response)
+			if response.status_code not in RETRY_STATUSES:
+				raise error
+			retry_after = response.headers.get('Retry-After')
+
+		if attempt < retries:
+			time.sleep(_backoff(attempt, retry_after))
+
+	raise error
+
+
+def _decode(response):
+
+	""" Returns the decoded JSON body of a response, raising FPLAPIError if it is not JSON, such as a maintenance page. """
+	try:
+		return response.json()
+	except ValueError as e:
+		raise FPLAPIError(f"Response was code {response.status_code} but not JSON.", response.status_code, response.url) from e
+
+
+def get_json(path, timeout=TIMEOUT, retries=MAX_RETRIES):
+
+	""" Returns the decoded JSON body of an API path, retrying connection errors and transient failures. Each caller
+	decodes its own copy, so callers sharing a download never share mutable data. """
+	return _decode(_request(path, timeout=timeout, retries=retries))
+
+
+def get_json_if_modified(path, etag=None, last_modified=None, timeout=TIMEOUT, retries=MAX_RETRIES):
+
+	""" Conditionally fetches an API path using the validators of a previous response. Returns a tuple of
+	(data, etag, last_modified) where data is None if the resource has not changed. """
+	headers = dict()
+	if etag:
+		headers['If-None-Match'] = etag
+	if last_modified:
+		headers['If-Modified-Since'] = last_modified
+
+	response = _request(path, headers=headers, timeout=timeout, retries=retries)
+	if response.status_code == 304:
+		return None, response.headers.get('ETag', etag), response.headers.get('Last-Modified', last_modified)
+
+	return _decode(response), response.headers.get('ETag'), response.headers.get('Last-Modified')
+
+
+def iter_many(paths, max_workers=MAX_WORKERS, return_exceptions=False, timeout=TIMEOUT, retries=MAX_RETRIES):
+
+	""" Fetches many API paths concurrently, with at most max_workers requests in flight, and yields
+	(index, body) pairs in the order the fetches finish. If return_exceptions is True, failed fetches
+	yield their FPLAPIError in place of a body instead of raising. """
+	paths = list(paths)
+	if not paths:
+		return
+
+	def fetch(path):
+		try:
+			return get_json(path, timeout=timeout, retries=retries)
+		except FPLAPIError as e:
+			if return_exceptions:
+				return e
+			raise
+
+	# each task runs in a copy of the caller's context so its requests are recorded against the caller's render
+	with ThreadPoolExecutor(max_workers=min(max_workers, len(paths))) as pool:
+		futures = {pool.submit(metrics.propagate(fetch), path): i for i, path in enumerate(paths)}
+		for future in as_completed(futures):
+			yield futures[future], future.result()
+
+
+def get_many(paths, max_workers=MAX_WORKERS, return_exceptions=False, timeout=TIMEOUT, retries=MAX_RETRIES):
+
+	""" Fetches many API paths concurrently, with at most max_workers requests in flight, and returns
+	their decoded bodies in the same order as paths. If return_exceptions is True, failed fetches
+	return their FPLAPIError in place of a result instead of raising. """
+	paths = list(paths)
+	results = [None] * len(paths)
+	for i, data in iter_many(paths, max_workers, return_exceptions, timeout, retries):
+		results[i] = data
+
+	return results
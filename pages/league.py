@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+from pages import league_utils, overall_utils, figures, tables, fpl_client
+
+
+def app():
+
+	header = st.container()
+	header.title("Compare the managers of a mini-league")
+	header.text(f"The top {league_utils.MAX_ENTRIES:,} entries of a classic league are compared across the season.")
+	league_id = header.text_input("Enter Classic League ID", value = 314)
+
+	base_data = overall_utils.get_base_data()
+
+	# entries are fetched in batches; the bar fills as each batch arrives
+	progress = header.progress(0)
+	try:
+		for done, steps, league in league_utils.iter_league(league_id,
+				overall_utils.current_gameweek(base_data), overall_utils.finished_gameweek(base_data)):
+			progress.progress(done / max(steps, 1))
+	except fpl_client.FPLAPIError as e:
+		progress.empty()
+		header.error(str(e))
+		return
+	progress.empty()
+
+	if league.truncated:
+		header.write(f"**{league.league['name']}**: the top {len(league.standings):,} entries are compared; the league has more.")
+	else:
+		header.write(f"**{league.league['name']}**: all {len(league.standings):,} entries are compared.")
+	if len(league.failed):
+		header.warning(f"{len(league.failed):,} entries could not be fetched and are left out: "
+			+ ', '.join(str(entry) for entry in league.failed))
+
+	summary = st.container()
+	with summary:
+		summary.header("League summary")
+		summary.text("Captain hit rate is the share of gameweeks in which the captain was the top scorer of the squad.\n"
+			f"Captain figures cover the top {league.captain_entries:,} entries.")
+		tables.dataframe(summary, 'league_summary', league.summary())
+		summary.write("\n")
+
+	if not len(league.gameweeks):
+		summary.info("The season has not started yet, so there are no gameweeks to compare.")
+		return
+
+	trajectories = st.container()
+	with trajectories:
+		trajectories.header("Across the season")
+		trajectories.text(f"Charts show the top {league_utils.CHART_ENTRIES} entries of the league.")
+
+		points_df = league.by_gameweek(league.points)
+		average = pd.Series(np.nanmean(league.points, axis=0), index=league.gameweeks)
+		figures.cached_chart(trajectories, 'league_points_chart', (points_df, average),
+			lambda: league_utils.points_chart(points_df, average))
+
+		ranks_df = league.by_gameweek(league.league_rank)
+		figures.cached_chart(trajectories, 'league_rank_chart', ranks_df, lambda: league_utils.rank_chart(ranks_df))
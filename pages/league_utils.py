@@ -0,0 +1,287 @@
+"""
+This file contains the functions used to ingest and compare the entries of a classic mini-league. Standings
+are paged through concurrently, then each entry's history, one request per entry, is fetched in batches through the
+snapshot store and reduced to (entries x gameweeks) arrays, so every comparison is computed for the whole league at
+once. Picks, a request per entry and gameweek, are only fetched for the captain figures of the top entries. Batches
+are yielded as they finish so pages can show their progress, and an entry that cannot be fetched is recorded and left
+out rather than failing the league.
+"""
+import os
+import numpy as np
+import pandas as pd
+from pages import fpl_client, snapshot_store, player_history, manager_history, metrics, cache
+
+# entries on each standings page served by the FPL API
+STANDINGS_PAGE_SIZE = 50
+
+# standings pages requested concurrently once a league is known to have more than one
+PAGE_BATCH = 8
+
+# entries whose history or picks are requested together; raw payloads are dropped after each batch
+ENTRY_BATCH = 50
+
+# most entries ingested from the top of a league, each costing one history request on a cold store
+MAX_ENTRIES = int(os.environ.get('FPL_LEAGUE_MAX_ENTRIES', 1000))
+
+# entries from the top of a league whose captains are compared, each costing a picks request per gameweek
+CAPTAIN_ENTRIES = int(os.environ.get('FPL_LEAGUE_CAPTAIN_ENTRIES', 20))
+
+# entries drawn in the league charts
+CHART_ENTRIES = 20
+
+
+def standings_path(league_id, page):
+	return f'leagues-classic/{league_id}/standings/?page_standings={page}'
+
+
+@metrics.timer('league_standings', 'fetch')
+def league_standings(league_id, max_entries=MAX_ENTRIES):
+
+	""" Returns the league details, a data frame of the standings of a classic league limited to its top max_entries,
+	and whether the league has more entries than that. The first page is fetched alone; the rest are fetched
+	PAGE_BATCH pages at a time until the last page. """
+
+	try:
+		first = snapshot_store.get_json(standings_path(league_id, 1))
+	except fpl_client.FPLUpdatingError:
+		raise
+	except fpl_client.FPLAPIError as e:
+		if e.status_code is None:
+			raise
+		raise type(e)(f"Response was code {e.status_code}. Please Enter a valid league ID.", e.status_code, e.url) from e
+
+	results = list(first['standings']['results'])
+	has_next = first['standings']['has_next']
+	n_pages = -(-max_entries // STANDINGS_PAGE_SIZE)
+	page = 2
+
+	while has_next and page <= n_pages:
+		pages = range(page, min(page + PAGE_BATCH, n_pages + 1))
+		for data in snapshot_store.get_many([standings_path(league_id, p) for p in pages]):
+			results += data['standings']['results']
+			has_next = data['standings']['has_next']
+			if not has_next:
+				break
+		page += PAGE_BATCH
+
+	standings = pd.DataFrame(results, columns=['entry', 'entry_name', 'player_name', 'rank', 'last_rank', 'total', 'event_total'])
+	return first['league'], standings.head(max_entries).reset_index(drop=True), has_next or len(standings) > max_entries
+
+
+class League:
+
+	""" Gameweek arrays of every ingested entry of a classic league, one row per entry in standings order and
+	column 0 holding gameweek 1. Gameweeks an entry did not play are nan, as are all gameweeks of the entries in
+	failed, whose history could not be fetched. Captain and best points are only known for the top captain_entries
+	entries and are nan for the rest. truncated is set if the league has more entries than were ingested. """
+	def __init__(self, league, standings, truncated, failed, captain_entries, points, total_points, overall_rank, bench_points, transfer_costs, captain_points, best_points) -> None:
+		self.league = league
+		self.standings = standings
+		self.truncated = truncated
+		self.failed = failed
+		self.captain_entries = captain_entries
+		self.points = points
+		self.total_points = total_points
+		self.overall_rank = overall_rank
+		self.bench_points = bench_points
+		self.transfer_costs = transfer_costs
+		self.captain_points = captain_points
+		self.best_points = best_points
+		self.gameweeks = np.arange(1, points.shape[1] + 1)
+
+	@property
+	def labels(self):
+		return (self.standings['entry_name'] + ' (' + self.standings['player_name'] + ')').to_numpy()
+
+	@property
+	def points_after_hits(self):
+		return self.points - self.transfer_costs
+
+	@property
+	def league_rank(self):
+
+		""" Rank of each entry within the league after each gameweek, by total points. """
+		return pd.DataFrame(self.total_points).rank(axis=0, method='min', ascending=False).to_numpy()
+
+	@property
+	def captain_hits(self):
+
+		""" Whether each entry's captain was the top scorer of their squad in each gameweek they picked a team. """
+		return (self.captain_points >= self.best_points) & ~np.isnan(self.captain_points)
+
+	@property
+	def captain_hit_rate(self):
+		picked = (~np.isnan(self.captain_points)).sum(axis=1)
+		return np.divide(self.captain_hits.sum(axis=1), picked, out=np.full(len(picked), np.nan), where=picked > 0)
+
+	def summary(self):
+
+		""" Returns a data frame comparing the season of every entry not in failed: points, captaincy, bench points,
+		hits and ranks. Before the first gameweek every figure but the standings is empty. """
+		played = (~np.isnan(self.points)).sum(axis=1)
+		captained = (~np.isnan(self.captain_points)).any(axis=1)
+
+		summary = self.standings[['rank', 'entry_name', 'player_name', 'total']].copy()
+		summary['points_per_gameweek'] = np.round(np.nansum(self.points, axis=1) / np.maximum(played, 1), 1)
+		summary['captain_points'] = pd.array(np.nansum(self.captain_points, axis=1).astype(int), dtype='Int64')
+		summary.loc[~captained, 'captain_points'] = pd.NA
+		summary['captain_hit_rate'] = np.round(self.captain_hit_rate, 2)
+		summary['bench_points'] = np.nansum(self.bench_points, axis=1).astype(int)
+		summary['transfer_costs'] = np.nansum(self.transfer_costs, axis=1).astype(int)
+		# initial keeps the reduction defined when no gameweek has been played
+		summary['best_overall_rank'] = np.where(np.isnan(self.overall_rank), np.inf, self.overall_rank).min(axis=1, initial=np.inf)
+		summary['best_overall_rank'] = summary['best_overall_rank'].replace(np.inf, np.nan)
+
+		return summary[~self.standings['entry'].isin(self.failed).to_numpy()]
+
+	def by_gameweek(self, values, n_entries=CHART_ENTRIES):
+
+		""" Returns a long data frame of gameweek, entry and value for the top n_entries entries, for plotting. """
+		values = values[:n_entries]
+		return pd.DataFrame(dict(
+			gameweek=np.tile(self.gameweeks, len(values)),
+			entry=np.repeat(self.labels[:n_entries], len(self.gameweeks)),
+			value=values.ravel())).dropna()
+
+
+def _history_rows(history, n_gameweeks):
+
+	""" Returns a (5 x gameweeks) array of the points, total points, overall rank, bench points and transfer costs
+	in an entry's history. """
+	rows = np.full((5, n_gameweeks), np.nan)
+	for gameweek in history['current']:
+		if 1 <= gameweek['event'] <= n_gameweeks:
+			rows[:, gameweek['event'] - 1] = (gameweek['points'], gameweek['total_points'], gameweek['overall_rank'],
+				gameweek['points_on_bench'], gameweek['event_transfers_cost'])
+
+	return rows
+
+
+def iter_league(league_id, current_gw, finished_gw=0, max_entries=MAX_ENTRIES, captain_entries=CAPTAIN_ENTRIES):
+
+	""" Yields (steps done, steps, None) once the standings are known and after each batch, and finally
+	(steps, steps, League) for the top max_entries entries of a classic league, a step being the history of an
+	entry or the picks of one of the top captain_entries entries. Histories are fetched ENTRY_BATCH at a time, each
+	batch concurrently, then the picks of the gameweeks each top entry played; picks of gameweeks up to finished_gw
+	are kept in the snapshot store permanently, so refetching a league only downloads the live gameweek. A League
+	with no failed entries is kept in the live cache and yielded at once on later calls. """
+
+	key = ('league', league_id, current_gw, finished_gw, max_entries, captain_entries)
+	cached = cache.live.get(key)
+	if cached is not cache.MISSING:
+		yield 1, 1, cached
+		return
+
+	league, standings, truncated = league_standings(league_id, max_entries)
+	entries = standings['entry'].to_numpy()
+	n_captains = min(captain_entries, len(entries))
+	steps = len(entries) + n_captains
+	yield 0, steps, None
+
+	histories = np.full((5, len(entries), current_gw), np.nan)
+	failed = set()
+	for start in range(0, len(entries), ENTRY_BATCH):
+		batch = entries[start:start + ENTRY_BATCH]
+		# keyed by the finished gameweek like manager histories, replacing the snapshots of earlier ones
+		responses = snapshot_store.get_many([f'entry/{entry}/history/' for entry in batch],
+			gameweeks=[finished_gw] * len(batch), return_exceptions=True, latest=True)
+
+		for i, history in enumerate(responses):
+			if isinstance(history, fpl_client.FPLUpdatingError):
+				raise history
+			if isinstance(history, Exception):
+				failed.add(start + i)
+				continue
+			histories[:, start + i] = _history_rows(history, current_gw)
+
+		yield start + len(batch), steps, None
+
+	elements = np.zeros((n_captains, current_gw, 15), dtype=np.int32)
+	is_captain = np.zeros((n_captains, current_gw, 15), dtype=bool)
+	for start in range(0, n_captains, ENTRY_BATCH):
+		# only the gameweeks in an entry's history have picks, so none are requested from before it joined
+		requests = [(row, gw) for row in range(start, min(start + ENTRY_BATCH, n_captains)) if row not in failed
+			for gw in np.flatnonzero(~np.isnan(histories[0, row])).tolist()]
+		responses = snapshot_store.get_many([f'entry/{entries[row]}/event/{gw + 1}/picks/' for row, gw in requests],
+			gameweeks=[gw + 1 for _, gw in requests],
+			ttls=[snapshot_store.PERMANENT if gw + 1 <= finished_gw else snapshot_store.LIVE_TTL for _, gw in requests],
+			return_exceptions=True)
+
+		# an entry whose picks cannot be fetched has no captain figures rather than some of them
+		for (row, gw), picks in zip(requests, responses):
+			if isinstance(picks, fpl_client.FPLUpdatingError):
+				raise picks
+			if isinstance(picks, Exception):
+				elements[row] = 0
+				is_captain[row] = False
+				failed.add(row)
+				continue
+			if row in failed:
+				continue
+			picks = manager_history.parse_picks(picks)[:15]
+			elements[row, gw, :len(picks)] = picks['element']
+			is_captain[row, gw, :len(picks)] = picks['is_captain']
+
+		yield len(entries) + min(start + ENTRY_BATCH, n_captains), steps, None
+
+	# look up every distinct player's history once, then gather the points of every pick of the top entries
+	player_ids, slot_index = np.unique(elements, return_inverse=True)
+	player_points = np.full((len(player_ids), player_history.panel.n_gameweeks), np.nan)
+	picked = player_ids > 0
+	player_points[picked] = player_history.panel.points_matrix(player_ids[picked])
+	points = player_points[slot_index.reshape(elements.shape), np.arange(current_gw)[np.newaxis, :, np.newaxis]]
+
+	captain_points = np.full((len(entries), current_gw), np.nan)
+	best_points = np.full((len(entries), current_gw), np.nan)
+	has_picks = is_captain.any(axis=2)
+	captain_points[:n_captains] = np.where(has_picks, np.nansum(np.where(is_captain, points, 0), axis=2), np.nan)
+	best_points[:n_captains] = np.where(has_picks, np.nanmax(np.where(np.isnan(points), -np.inf, points), axis=2), np.nan)
+
+	# a failed entry is left out whole rather than shown with some of its figures
+	failed = np.array(sorted(failed), dtype=int)
+	histories[:, failed] = np.nan
+	captain_points[failed] = np.nan
+	best_points[failed] = np.nan
+
+	result = League(league, standings, truncated, entries[failed], n_captains, *histories, captain_points, best_points)
+	# a league with failed entries is fetched again on the next call, so they are retried
+	if not len(failed):
+		cache.live.put(key, result)
+
+	yield steps, steps, result
+
+
+@metrics.timer('league_data', 'fetch')
+def league_data(league_id, current_gw, finished_gw=0, max_entries=MAX_ENTRIES, captain_entries=CAPTAIN_ENTRIES):
+
+	""" Returns the League of iter_league once all of its entries have been fetched. """
+	for _, _, league in iter_league(league_id, current_gw, finished_gw, max_entries, captain_entries):
+		pass
+
+	return league
+
+
+def points_chart(points_df, average):
+
+	""" Returns line chart of the points each entry scored in each gameweek, with the gameweek average. """
+	import plotly.express as px
+
+	fig = px.line(points_df, x='gameweek', y='value', color='entry',
+		labels={"gameweek": "Gameweek", "value": "Points", "entry": "Team"},
+		title="Points across each gameweek")
+	fig.add_scatter(x=average.index, y=average.values, name='League average', line=dict(color='black', dash='dash'))
+
+	return fig
+
+
+def rank_chart(ranks_df):
+
+	""" Returns line chart of each entry's rank within the league after each gameweek. """
+	import plotly.express as px
+
+	fig = px.line(ranks_df, x='gameweek', y='value', color='entry',
+		labels={"gameweek": "Gameweek", "value": "League rank", "entry": "Team"},
+		title="League rank across the season")
+	fig.update_yaxes(autorange='reversed')
+
+	return fig
@@ -0,0 +1,246 @@
+"""
+This file contains the process-wide store of each manager's season. A manager's history and picks are
+downloaded in full once; after that a refresh only fetches the picks of the gameweeks that are live or have
+finished since they were loaded, and merges the history row each picks payload carries into the existing
+history, so late in the season a refresh costs one or two requests instead of dozens. Payloads are parsed
+once into narrow-dtype structures and the raw JSON is dropped.
+"""
+import time
+import threading
+import numpy as np
+import pandas as pd
+from pages import fpl_client, snapshot_store, metrics, cache
+
+# seconds the live gameweek of a manager is used before it is fetched again
+LIVE_TTL = 60
+
+# one gameweek's picks, one record per squad slot
+PICK_DTYPE = np.dtype([
+	('element', np.int16),
+	('position', np.int8),
+	('multiplier', np.int8),
+	('is_captain', np.bool_),
+	('is_vice_captain', np.bool_)])
+
+# columns kept from each gameweek's history row; ranks are float since they are null until a gameweek is scored
+HISTORY_DTYPES = dict(
+	event=np.int8,
+	points=np.int16,
+	total_points=np.int16,
+	rank=np.float32,
+	overall_rank=np.float32,
+	bank=np.int16,
+	value=np.int16,
+	event_transfers=np.int8,
+	event_transfers_cost=np.int16,
+	points_on_bench=np.int16)
+
+
+def parse_picks(data):
+
+	""" Returns the picks of a picks payload as a structured array of PICK_DTYPE. """
+	return np.array([tuple(pick[field] for field in PICK_DTYPE.names) for pick in data['picks']], dtype=PICK_DTYPE)
+
+
+def history_frame(rows):
+
+	""" Returns a data frame of history rows with the columns and dtypes of HISTORY_DTYPES. """
+	return pd.DataFrame(list(rows), columns=list(HISTORY_DTYPES)).astype(HISTORY_DTYPES)
+
+
+class ManagerSeason:
+
+	""" The history rows and picks of one manager, with when each gameweek was fetched and whether it is final. """
+	def __init__(self) -> None:
+		self.history = None
+		self.history_fetched_at = dict()
+		self.history_final = set()
+		self.picks = dict()
+		self.picks_fetched_at = dict()
+		self.picks_final = set()
+		self.lock = threading.Lock()
+
+
+def _is_stale(fetched_at, final, gameweek, finished_gw, now, ttl):
+	if gameweek in final:
+		return False
+	if gameweek not in fetched_at:
+		return True
+	return gameweek <= finished_gw or now - fetched_at[gameweek] >= ttl
+
+
+class ManagerHistoryStore:
+
+	""" Store of every manager's season, keyed by FPL id and shared by every session in the process. Seasons are
+	held in a memory-bounded cache, the long-lived tier by default; an evicted season is loaded again in full. """
+	def __init__(self, live_ttl=LIVE_TTL, seasons=cache.immutable) -> None:
+		self.live_ttl = live_ttl
+		self.seasons = seasons
+		self._lock = threading.Lock()
+
+	def refresh(self) -> None:
+
+		""" Empties the cache holding the seasons so the next lookups download them in full. """
+		self.seasons.clear()
+
+	def _season(self, id):
+		with self._lock:
+			season = self.seasons.get(('manager_history', int(id)))
+			if season is cache.MISSING:
+				season = ManagerSeason()
+				self.seasons.put(('manager_history', int(id)), season)
+
+			return season
+
+	def _account(self, id, season) -> None:
+
+		""" Stores the season again so the cache accounts for the size it has grown to. """
+		self.seasons.put(('manager_history', int(id)), season)
+
+	def _keep_picks(self, season, event, data, finished_gw, now):
+
+		""" Keeps one gameweek's picks payload in the season and returns the history row it carries, or None if the
+		manager has no picks for that gameweek. """
+		if isinstance(data, Exception) and not isinstance(data, fpl_client.FPLNotFoundError):
+			raise data
+
+		# a manager has no picks for the gameweeks before they joined the game
+		season.picks[event] = None if isinstance(data, Exception) else parse_picks(data)
+		season.picks_fetched_at[event] = now
+		if event <= finished_gw:
+			season.picks_final.add(event)
+
+		return None if season.picks[event] is None else data['entry_history']
+
+	def _download_picks(self, id, season, gameweeks, finished_gw):
+
+		""" Fetches the picks of the given gameweeks concurrently and yields (gameweek, payload) pairs as each fetch finishes.
+		Gameweeks fetched before are fetched from the API, since they were live; the rest read through the snapshot store,
+		finished ones only from a permanent snapshot. """
+		metrics.count('cache_misses_total', len(gameweeks), cache='manager_history')
+		with season.lock:
+			seen = [gameweek for gameweek in gameweeks if gameweek in season.picks_fetched_at]
+			new = [gameweek for gameweek in gameweeks if gameweek not in season.picks_fetched_at]
+
+		for events, refresh in ((new, False), (seen, True)):
+			for i, data in snapshot_store.iter_many([f'entry/{id}/event/{event}/picks/' for event in events],
+				gameweeks=events,
+				ttls=[snapshot_store.PERMANENT if event <= finished_gw else snapshot_store.LIVE_TTL for event in events],
+				return_exceptions=True, refresh=refresh):
+				yield events[i], data
+
+	def _merge_history(self, season, rows, finished_gw, now) -> None:
+
+		""" Replaces or adds the history rows of the gameweeks in rows. """
+		rows = history_frame(rows)
+		history = season.history[~season.history['event'].isin(rows['event'])]
+		season.history = pd.concat([history, rows], ignore_index=True).sort_values('event', ignore_index=True)
+		for event in rows['event'].tolist():
+			season.history_fetched_at[event] = now
+			if event <= finished_gw:
+				season.history_final.add(event)
+
+	def _load_history(self, id, season, finished_gw) -> None:
+
+		""" Downloads a manager's history into a season that has none. The gameweeks before the manager joined the game
+		are marked as final with no picks, so neither their history nor their picks are ever looked up. """
+		metrics.cache_hit('manager_history', False)
+		# keyed by the finished gameweek, so a snapshot taken before the last gameweek finished is never read as final;
+		# the snapshots of earlier finished gameweeks are never read again and are deleted
+		data = snapshot_store.get_json(f'entry/{id}/history/', gameweek=finished_gw, latest=True)
+		with season.lock:
+			if season.history is not None:
+				return
+
+			now = time.time()
+			season.history = history_frame(data['current'])
+			for event in season.history['event'].tolist():
+				season.history_fetched_at[event] = now
+				if event <= finished_gw:
+					season.history_final.add(event)
+
+			joined = data['current'][0]['event'] if data['current'] else 1
+			for gameweek in range(1, joined):
+				season.history_fetched_at[gameweek] = now
+				season.history_final.add(gameweek)
+				season.picks[gameweek] = None
+				season.picks_fetched_at[gameweek] = now
+				season.picks_final.add(gameweek)
+
+	def history(self, id, current_gw, finished_gw=0):
+
+		""" Returns a data frame of a manager's history row for each gameweek played so far. The history is downloaded
+		once; later calls only fetch the picks of stale gameweeks and merge their rows in. Downloads happen outside
+		the season's lock, which is only taken to read or update the season. """
+		season = self._season(id)
+		downloaded = season.history is None
+		if downloaded:
+			self._load_history(id, season, finished_gw)
+
+		with season.lock:
+			now = time.time()
+			stale = [gameweek for gameweek in range(1, current_gw + 1)
+				if _is_stale(season.history_fetched_at, season.history_final, gameweek, finished_gw, now, self.live_ttl)]
+			metrics.count('cache_hits_total', current_gw - len(stale), cache='manager_history')
+
+		for event, data in self._download_picks(id, season, stale, finished_gw):
+			with season.lock:
+				row = self._keep_picks(season, event, data, finished_gw, now)
+				if row is not None:
+					self._merge_history(season, [row], finished_gw, now)
+
+		with season.lock:
+			# gameweeks before the manager joined have no history row and are not looked up again
+			for gameweek in stale:
+				season.history_fetched_at.setdefault(gameweek, now)
+				if gameweek <= finished_gw:
+					season.history_final.add(gameweek)
+			history = season.history
+
+		if downloaded or stale:
+			self._account(id, season)
+
+		return history
+
+	def iter_picks(self, id, current_gw, finished_gw=0):
+
+		""" Yields (gameweek, picks) pairs for gameweeks 1 to current_gw, as picks() returns them: gameweeks already held
+		are yielded at once and stale ones as each of their fetches finishes, in the order they finish. The season is
+		only locked while it is read or updated, so a slow consumer never holds up other sessions. """
+		season = self._season(id)
+		if season.history is None:
+			# the history tells which gameweeks came before the manager joined, so their picks are not requested
+			self._load_history(id, season, finished_gw)
+			self._account(id, season)
+
+		with season.lock:
+			now = time.time()
+			stale = [gameweek for gameweek in range(1, current_gw + 1)
+				if _is_stale(season.picks_fetched_at, season.picks_final, gameweek, finished_gw, now, self.live_ttl)]
+			metrics.count('cache_hits_total', current_gw - len(stale), cache='manager_history')
+			fresh = [(gameweek, season.picks[gameweek]) for gameweek in range(1, current_gw + 1) if gameweek not in stale]
+
+		yield from fresh
+		if not stale:
+			return
+
+		for event, data in self._download_picks(id, season, stale, finished_gw):
+			with season.lock:
+				row = self._keep_picks(season, event, data, finished_gw, now)
+				if season.history is not None and row is not None:
+					self._merge_history(season, [row], finished_gw, now)
+				picks = season.picks[event]
+
+			yield event, picks
+
+		self._account(id, season)
+
+	def picks(self, id, current_gw, finished_gw=0):
+
+		""" Returns a dictionary of a manager's picks for gameweeks 1 to current_gw, keyed by gameweek, as structured
+		arrays of PICK_DTYPE, with None for the gameweeks they have no picks for. Only the picks of stale gameweeks are fetched. """
+		picks = dict(self.iter_picks(id, current_gw, finished_gw))
+		return {gameweek: picks[gameweek] for gameweek in range(1, current_gw + 1)}
+
+
+store = ManagerHistoryStore()
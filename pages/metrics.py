@@ -0,0 +1,238 @@
+"""
+This file contains the instrumentation layer. Every page render records the time spent in each fetcher,
+transform and chart builder, the HTTP calls, bytes and retries made, and the hits and misses of each cache.
+Renders are logged as structured JSON lines, totals are kept process-wide for Prometheus-style export and
+an optional sidebar debug panel shows the latest render.
+"""
+import os
+import json
+import time
+import logging
+import threading
+import contextlib
+import contextvars
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('fpl.metrics')
+
+# show the sidebar debug panel
+DEBUG_PANEL = os.environ.get('FPL_DEBUG', '') not in ('', '0')
+
+# serve process-wide totals in the Prometheus text format on this port, 0 disables the endpoint
+METRICS_PORT = int(os.environ.get('FPL_METRICS_PORT', 0))
+
+# address the metrics endpoint listens on; set to 0.0.0.0 to let a scraper on another host reach it
+METRICS_HOST = os.environ.get('FPL_METRICS_HOST', '127.0.0.1')
+
+
+class Render:
+
+	""" Measurements taken while rendering one page. """
+	def __init__(self, page) -> None:
+		self.page = page
+		self.started = time.time()
+		self.seconds = 0.0
+		self.timings = defaultdict(lambda: dict(kind='', calls=0, seconds=0.0))
+		self.counters = defaultdict(float)
+		self._lock = threading.Lock()
+
+	def add_timing(self, name, kind, seconds) -> None:
+		with self._lock:
+			timing = self.timings[name]
+			timing['kind'] = kind
+			timing['calls'] += 1
+			timing['seconds'] += seconds
+
+	def add(self, name, value) -> None:
+		with self._lock:
+			self.counters[name] += value
+
+	def as_dict(self):
+		with self._lock:
+			return dict(
+				page=self.page,
+				started=self.started,
+				seconds=round(self.seconds, 6),
+				timings={name: dict(timing, seconds=round(timing['seconds'], 6)) for name, timing in self.timings.items()},
+				counters=dict(self.counters))
+
+
+class Registry:
+
+	""" Process-wide totals of every counter and timing, labelled by name. """
+	def __init__(self) -> None:
+		self.counters = defaultdict(float)
+		self.gauges = dict()
+		self.timings = defaultdict(lambda: [0, 0.0])
+		self._lock = threading.Lock()
+
+	def add(self, name, value, labels=()) -> None:
+		with self._lock:
+			self.counters[(name, labels)] += value
+
+	def set(self, name, value, labels=()) -> None:
+		with self._lock:
+			self.gauges[(name, labels)] = value
+
+	def add_timing(self, name, kind, seconds) -> None:
+		with self._lock:
+			timing = self.timings[(name, kind)]
+			timing[0] += 1
+			timing[1] += seconds
+
+	def prometheus_text(self):
+
+		""" Returns the totals in the Prometheus text exposition format. """
+		with self._lock:
+			counters = sorted(self.counters.items()) + sorted(self.gauges.items())
+			timings = sorted(self.timings.items())
+
+		lines = list()
+		for (name, labels), value in counters:
+			label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+			lines.append(f'fpl_{name}{{{label_text}}} {value:g}' if label_text else f'fpl_{name} {value:g}')
+		for (name, kind), (calls, seconds) in timings:
+			lines.append(f'fpl_function_calls_total{{function="{name}",kind="{kind}"}} {calls}')
+			lines.append(f'fpl_function_seconds_total{{function="{name}",kind="{kind}"}} {seconds:.6f}')
+
+		return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+_current = contextvars.ContextVar('fpl_render', default=None)
+
+
+def current_render():
+
+	""" Returns the Render being recorded in this context, or None outside a page render. """
+	return _current.get()
+
+
+@contextlib.contextmanager
+def render(page):
+
+	""" Records the measurements taken while rendering page, logging them as a JSON line when it finishes. """
+	recorder = Render(page)
+	token = _current.set(recorder)
+	start = time.perf_counter()
+	try:
+		yield recorder
+	finally:
+		recorder.seconds = time.perf_counter() - start
+		_current.reset(token)
+		registry.add('page_renders_total', 1, (('page', page),))
+		registry.add('page_seconds_total', recorder.seconds, (('page', page),))
+		logger.info(json.dumps(recorder.as_dict()))
+
+
+def count(name, value=1, **labels) -> None:
+
+	""" Adds value to a counter of the current render and to its process-wide total. """
+	recorder = _current.get()
+	if recorder is not None:
+		key = name if not labels else name + '{' + ','.join(f'{k}={v}' for k, v in sorted(labels.items())) + '}'
+		recorder.add(key, value)
+	registry.add(name, value, tuple(sorted(labels.items())))
+
+
+def gauge(name, value, **labels) -> None:
+
+	""" Sets the process-wide value of a gauge, such as the bytes a cache holds. """
+	registry.set(name, value, tuple(sorted(labels.items())))
+
+
+def cache_hit(cache, hit=True) -> None:
+
+	""" Counts a hit or miss of the named cache. """
+	count('cache_hits_total' if hit else 'cache_misses_total', cache=cache)
+
+
+class timer(contextlib.ContextDecorator):
+
+	""" Times a block, or every call of a decorated function, under name. kind groups timings in the debug
+	panel, e.g. 'fetch' for network, 'transform' for pandas and NumPy work and 'chart' for Plotly figures. """
+	def __init__(self, name, kind='transform') -> None:
+		self.name = name
+		self.kind = kind
+		self._starts = threading.local()
+
+	def __enter__(self):
+		self._starts.__dict__.setdefault('stack', []).append(time.perf_counter())
+		return self
+
+	def __exit__(self, *exc):
+		seconds = time.perf_counter() - self._starts.stack.pop()
+		recorder = _current.get()
+		if recorder is not None:
+			recorder.add_timing(self.name, self.kind, seconds)
+		registry.add_timing(self.name, self.kind, seconds)
+		return False
+
+
+def propagate(func):
+
+	""" Returns func bound to a copy of the caller's context, so work run on a thread pool is recorded
+	against the render that started it. """
+	context = contextvars.copy_context()
+	return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def debug_panel(recorder) -> None:
+
+	""" Shows the measurements of a render in a sidebar expander. """
+	import pandas as pd
+	import streamlit as st
+
+	data = recorder.as_dict()
+	panel = st.sidebar.expander("Debug: render metrics")
+	with panel:
+		panel.write(f"Rendered **{data['page']}** in {data['seconds']:.3f}s")
+		if data['timings']:
+			timings = pd.DataFrame.from_dict(data['timings'], orient='index').sort_values('seconds', ascending=False)
+			panel.write("Time by kind (s)")
+			panel.dataframe(timings.groupby('kind')['seconds'].sum())
+			panel.write("Time by function (s)")
+			panel.dataframe(timings)
+		if data['counters']:
+			panel.write("Counters")
+			panel.dataframe(pd.Series(data['counters'], name='value'))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+	def do_GET(self) -> None:
+		body = registry.prometheus_text().encode()
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args) -> None:
+		pass
+
+
+_server = None
+_server_lock = threading.Lock()
+# set once serving failed, such as when another worker on the host holds the port, so it is not retried each render
+_server_failed = False
+
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+
+	""" Serves process-wide totals for Prometheus on host and port, once per process. Does nothing if port is 0.
+	If the port cannot be bound a warning is logged once and the process runs without the endpoint. """
+	global _server, _server_failed
+
+	with _server_lock:
+		if _server is None and port and not _server_failed:
+			try:
+				_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+			except OSError as e:
+				_server_failed = True
+				logger.warning("Could not serve metrics on %s:%s: %s", host, port, e)
+			else:
+				threading.Thread(target=_server.serve_forever, daemon=True).start()
+
+	return _server
@@ -1,134 +1,119 @@
-import time
-import json
-import requests
 import pandas as pd 
 import numpy as np
-import streamlit as st 
-from itertools import repeat
-import plotly.express as px 
-# import plotly.graph_objects as go
-# from plotly.subplots import make_subplots
+from pages import fpl_client, player_history, manager_history, snapshot_store, metrics, cache
 
-@st.cache
+def manager_id(id):
+
+	""" Returns an FPL id entered on a page as an int, raising FPLNotFoundError if it is not a number. """
+	try:
+		return int(id)
+	except (TypeError, ValueError):
+		raise fpl_client.FPLNotFoundError("Please Enter a valid FPL ID.", 404, fpl_client.build_url(f'entry/{id}/')) from None
+
+
+@metrics.timer('manager_info', 'fetch')
+@cache.memoize(cache.live)
 def manager_info(id):
 
 	""" Returns basic information about an FPL manager including name, current points and overall and league rankings. """
-	base_url = 'https://fantasy.premierleague.com/api/entry/'
-	id_url = base_url + str(id) + '/'
+	try:
+		return snapshot_store.get_json(f'entry/{id}/')
+	except fpl_client.FPLUpdatingError:
+		raise
+	except fpl_client.FPLAPIError as e:
+		if e.status_code is None:
+			raise
+		raise type(e)(f"Response was code {e.status_code}. Please Enter a valid FPL ID.", e.status_code, e.url) from e
 
-	response = ''
-	while response == '':
-		try:
-			response = requests.get(id_url)
-		except:
-			time.sleep(5)
-	if response.status_code != 200:
-		if response.status_code == 503:
-			raise Exception(f"The game is currently updating, please try again at a later time.")
-		else:
-			raise Exception(f"Response was code {response.status_code}. Please Enter a valid FPL ID.")
+@metrics.timer('current_data', 'fetch')
+def current_data(id, current_gw, finished_gw=0):
+	""" Returns data frame containing information on manager's current season performance, one row per gameweek.
+	The season is downloaded once per process; later calls only fetch the gameweeks that are live or have just finished. """
 
-	data = json.loads(response.text)
+	return manager_history.store.history(id, current_gw, finished_gw)
 
-	return data 
+@metrics.timer('history_df', 'transform')
+def history_df(manager_data):
+	""" Returns data frame of a manager's performance in each gameweek of the current season, with costs in millions and points after hits. """
 
-@st.cache
-def current_data(id):
-	""" Returns data frame containing information on manager's historical and current season performance."""
+	current_data_df = manager_data.copy()
 
-	base_url = "https://fantasy.premierleague.com/api/entry/"
-	full_url = base_url + str(id) + '/history/'
+	# cleaning up the data frame:
+	current_data_df['bank'] = current_data_df['bank'] / 10
+	current_data_df['value'] = current_data_df['value'] / 10
+	current_data_df['points_after_hits'] = current_data_df['points'] - current_data_df['event_transfers_cost']
 
-	response = ''
-	while response == '':
-		try:
-			response = requests.get(full_url)
-		except:
-			time.sleep(5)
-	if response.status_code != 200:
-		raise Exception(f"Response was code {response.status_code}.")
+	return current_data_df
 
-	data = json.loads(response.text)
+@metrics.timer('gameweek_data', 'fetch')
+def gameweek_data(id, current_gw, finished_gw=0):
 
-	return data 
+	""" Returns dictionary of a manager's picks for each gameweek they picked a team in, keyed by gameweek; gameweeks
+	before they joined the game are left out. Picks are kept per process and only the gameweeks that are live or
+	have just finished are fetched again; picks of gameweeks up to finished_gw are kept in the snapshot store permanently. """
 
-@st.cache
-def gameweek_data(id):
+	try:
+		picks = manager_history.store.picks(id, current_gw, finished_gw)
+	except fpl_client.FPLNotFoundError as e:
+		raise _not_found(id) from e
 
-	""" Returns data frame containing information of a manager's performance for each gameweek played so far."""
+	events_dict = {event: data for event, data in picks.items() if data is not None}
+	if not events_dict:
+		raise _not_found(id)
 
-	base_url = f"https://fantasy.premierleague.com/api/entry/{id}/event/"
-	events_dict = dict()
+	return events_dict
 
-	for event in range(1, 39):
-		response = ''
-		full_url = base_url + str(event) + '/picks/'
-		while response == '':
-			try:
-				response = requests.get(full_url)
 
-			except:
-				time.sleep(5)
+def gameweek_results(id, current_gw, finished_gw, index):
 
-		if response.status_code != 200:
-			break
+	""" Yields a dictionary for each gameweek a manager picked a team in, as its picks arrive: the gameweek, the picks,
+	the captain and their points, and the top scoring player and their score. Gameweeks already held are yielded at
+	once and the rest in the order their downloads finish, so pages can show a season while it loads. """
 
-		data = json.loads(response.text)
-		events_dict[event] = data
+	found = False
+	try:
+		for gameweek, picks in manager_history.store.iter_picks(id, current_gw, finished_gw):
+			if picks is None:
+				continue
+			found = True
 
-	return events_dict
+			row = captain_table(squad_matrix({gameweek: picks}), index).to_dict('records')[0]
+			yield dict(row, picks=picks)
+	except fpl_client.FPLNotFoundError as e:
+		raise _not_found(id) from e
+
+	if not found:
+		raise _not_found(id)
 
 
-def get_captain_list(cap_data):
+def _not_found(id):
 
-	cap_list = list()
-	for k, v in cap_data.items():
-		for element in v['picks']:
-			if element['is_captain'] == True:
-				cap_list.append(element['element'])
+	""" Returns the error raised when an FPL id has no picks. """
+	return fpl_client.FPLNotFoundError("Response was code 404. Please Enter a valid FPL ID.", 404,
+		fpl_client.build_url(f'entry/{id}/event/1/picks/'))
 
-	return np.array(cap_list)
 
-@st.cache
 def get_player_points(player_id, gameweek):
 
 	""" Given a particular gameweek and a player_id, returns the points gained by that player in the
-	specified gameweek. """
-
-	url = f"https://fantasy.premierleague.com/api/element-summary/{player_id}/"
-	response = ''
-	
-	while response == '':
-		try:
-			response = requests.get(url)
-		except:
-			time.sleep(5)
-	
-	if response.status_code != 200:
-		raise Exception(f"Response was code {response.status_code}")
-
-	data = json.loads(response.text)
-
-	try:
-		points = data['history'][gameweek]['total_points']
-	except:
-		points = np.nan 
-
-	return points
+	specified gameweek. Gameweek 0 is the first gameweek. """
 
+	return player_history.panel.points(player_id, gameweek)
 
 
 def get_player_points_gw(list_of_players, gameweek):
 	""" Given a particular gameweek and list of players, returns an array of points, obtained in that week, 
 	corresponding to each of the players. """
 
-	return np.array(map(get_player_points, list_of_players, repeat(gameweek)))
+	return player_history.panel.points_for(list_of_players, gameweek)
 
-@st.cache
+
+@metrics.timer('create_display_gw_data', 'transform')
+@cache.memoize(cache.live)
 def create_display_gw_data(generic_gw_data, gameweek_id):
 	""" Returns data frame containing a manager's 15-man squad for each gameweek.
 	Returned data frame is sorted by points, effective_points. """
-	di_gw_data = generic_gw_data[['player', 'multiplier', 'is_captain', 'is_vice_captain']]
+	di_gw_data = generic_gw_data[['player', 'multiplier', 'is_captain', 'is_vice_captain']].copy()
 
 	## attach gameweek points to dataframe as well
 	di_gw_data['points'] = get_player_points_gw(generic_gw_data['element'], gameweek_id-1)
@@ -137,50 +122,91 @@ def create_display_gw_data(generic_gw_data, gameweek_id):
 	return di_gw_data.sort_values(by=['points', 'effective_points'], ascending=False)
 
 
-def top_player_chart(generic_gw_data, current_gw):
+class SquadMatrix:
 
-	for i in range(current_gw):
-		data = create_display_gw_data(generic_gw_data, i)
-		top_player, points, is_captain = data[0][['player', 'points', 'is_captain']]
+	""" Dense gameweek x squad-slot arrays of a manager's picks, with the element id, multiplier, captain flag
+	and points of every pick. Row i holds gameweeks[i]. """
+	def __init__(self, gameweeks, elements, multipliers, is_captain, points) -> None:
+		self.gameweeks = gameweeks
+		self.elements = elements
+		self.multipliers = multipliers
+		self.is_captain = is_captain
+		self.points = points
+		self.rows = np.arange(len(gameweeks))
 
-@st.cache
-def combined_df(gw_data, current_gw, lookup_table):
+	@property
+	def effective_points(self):
+		return self.points * self.multipliers
 
-	""" Returns a data frame containing the information on the highest scoring players of a manager's team for each gameweek. """
+	@property
+	def best_slot(self):
+		return np.argmax(np.where(np.isnan(self.points), -np.inf, self.points), axis=1)
 
-	gw_top_players = list()
+	@property
+	def best_elements(self):
+		return self.elements[self.rows, self.best_slot]
+
+	@property
+	def best_points(self):
+		return self.points[self.rows, self.best_slot]
+
+	@property
+	def captain_slot(self):
+		return np.argmax(self.is_captain, axis=1)
+
+	@property
+	def captain_elements(self):
+		return self.elements[self.rows, self.captain_slot]
+
+	@property
+	def captain_points(self):
+		return self.points[self.rows, self.captain_slot]
+
+	@property
+	def captain_vs_best(self):
+		return self.captain_points - self.best_points
 
-	for i in range(current_gw):
-		gw_scores = list()
-		for element in gw_data[i+1]['picks']:
-			gw_scores.append(dict(player_id = element['element'], score = get_player_points(element['element'], i)))
-		highest_score = max(gw_scores, key = lambda x: x['score'])
-		gw_top_players.append(highest_score)
-		
-	best_players = pd.DataFrame(gw_top_players)
-	best_players['top_player'] = [lookup_table.loc[lookup_table.id == id, "web_name"].item() for id in best_players.player_id]
-	best_players = best_players[['top_player', 'score']]
-	return best_players
 
+@metrics.timer('squad_matrix', 'transform')
+def squad_matrix(gw_data):
 
-def captain_performances(gameweek_data, lookup_table, current_gw):
-	""" Returns a data frame and a plotly, horizontal bar chart representing points scored by a manager's captains."""
-	cap_dict = dict()
+	""" Returns a SquadMatrix built in one pass over a manager's picks, given as a dictionary keyed by gameweek,
+	with one row per gameweek in order. """
 
-	for i in range(current_gw):
-		for element in gameweek_data[i+1]['picks']:
-			if element['is_captain'] == True:
-				cap_dict[i] = element['element']
-				break
+	gameweeks = np.array(sorted(gw_data), dtype=int)
+	n_slots = max((len(gw_data[gw]) for gw in gameweeks), default=0)
+	picks = np.zeros((len(gameweeks), n_slots), dtype=manager_history.PICK_DTYPE)
+	for row, gw in enumerate(gameweeks):
+		picks[row, :len(gw_data[gw])] = gw_data[gw]
 
-	cap_names = [lookup_table.loc[lookup_table.id == id, "web_name"].item() for id in cap_dict.values()]
+	elements = picks['element'].astype(np.int32)
+	multipliers = picks['multiplier']
+	is_captain = picks['is_captain']
 
-	cap_points = list()
-	for k, v in cap_dict.items():
-		cap_points.append(get_player_points(v, k))
+	# look up every distinct player's history once, then gather each pick's points for its gameweek
+	player_ids, slot_index = np.unique(elements, return_inverse=True)
+	histories = np.full((len(player_ids), player_history.panel.n_gameweeks), np.nan)
+	picked = player_ids > 0
+	histories[picked] = player_history.panel.points_matrix(player_ids[picked])
+	points = histories[slot_index.reshape(elements.shape), (gameweeks - 1)[:, np.newaxis]]
 
-	caps_df = pd.DataFrame(dict(captain=cap_names, points=cap_points))
-	caps_df['gameweek'] = caps_df.index + 1
+	return SquadMatrix(gameweeks, elements, multipliers, is_captain, points)
+
+
+@metrics.timer('captain_table', 'transform')
+def captain_table(squad, index):
+
+	""" Returns a data frame of a manager's captain and top scoring player and their points in each gameweek of squad,
+	with how many points the captain scored against the top player. """
+	return pd.DataFrame(dict(gameweek=squad.gameweeks,
+		captain=index.names(squad.captain_elements), points=squad.captain_points,
+		top_player=index.names(squad.best_elements), score=squad.best_points,
+		captain_vs_best=squad.captain_vs_best))
+
+
+def captain_chart(caps_df):
+	""" Returns horizontal bar chart of the points scored by a manager's captain each gameweek. """
+	import plotly.express as px
 
 	cap_fig  = px.bar(caps_df, x = 'points', y = 'gameweek', text='captain',
 		orientation='h',
@@ -189,5 +215,67 @@ def captain_performances(gameweek_data, lookup_table, current_gw):
 
 	cap_fig.update_traces(textposition='outside')	
 
-	return caps_df, cap_fig
-
+	return cap_fig
+
+
+def performance_charts(current_data_df):
+	""" Returns line charts of a manager's points, points after hits and average points, and of their overall rank, across the season. """
+	import plotly.express as px
+
+	# create line plot showing points, points_after_hits and average points across the season
+	plt = px.line(current_data_df, x='event', y=['points','points_after_hits','average_points'],
+		labels={
+			"event": "Gameweek",
+			"_value": "Points",
+			"variable": "Type"
+		},
+		title = "Points across each gameweek")
+
+	# create line plot showing rank across the season
+	plt_rank = px.line(current_data_df, x = 'event', y = ['overall_rank'],
+		labels = {
+		"event": "Gameweek",
+		"_value": "Rank",
+		"variable": "Type"
+		},
+		title="Your Overall Rank")
+
+	return plt, plt_rank
+
+
+def captain_comparison_chart(df):
+	""" Returns grouped bar chart comparing a manager's captain and top scoring player each gameweek. """
+	import plotly.graph_objects as go
+
+	fig = go.Figure()
+
+	fig.add_trace(go.Bar(x=df.gameweek,
+						y=df.points,
+						name='Captain',
+						marker_color='rgb(55, 83, 109)'))
+
+	fig.add_trace(go.Bar(x=df.gameweek,
+						y=df.score,
+						name='Top Player',
+						marker_color='rgb(26, 118, 255)'))
+
+	fig.update_layout(
+	title='Your Captain and Top Performers',
+	xaxis_tickfont_size=14,
+	yaxis=dict(
+		title='Points',
+		titlefont_size=16,
+		tickfont_size=14,
+	),
+	legend=dict(
+		x=0,
+		y=1.0,
+		bgcolor='rgba(255, 255, 255, 0)',
+		bordercolor='rgba(255, 255, 255, 0)'
+	),
+	barmode='group',
+	bargap=0.15, # gap between bars of adjacent location coordinates.
+	bargroupgap=0.1 # gap between bars of the same location coordinate.
+)
+
+	return fig
@@ -1,36 +1,48 @@
-import time
-import json
-import requests
+import os
 import pandas as pd 
-import numpy as np
-import streamlit as st 
-import plotly.express as px 
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from pages import cache, snapshot_store, metrics, element_index, figures
 
-#@st.cache
+# seconds the bootstrap payload is served before it is revalidated in the background
+BOOTSTRAP_TTL = int(os.environ.get('FPL_BOOTSTRAP_TTL', 300))
+
+# bubble chart downsampling: keep the BUBBLE_TOP_N best value players, or the best value player in each
+# (cost, points) cell of BUBBLE_CELL size
+BUBBLE_TOP_N = 50
+BUBBLE_CELL = (0.5, 10)
+BUBBLE_SAMPLING = {'All players': 'all', f'Top {BUBBLE_TOP_N} by points per million': 'top', 'One per cost/points cell': 'density'}
+
+bootstrap = cache.RevalidatingCache('bootstrap-static/', ttl=BOOTSTRAP_TTL, snapshots=snapshot_store.store)
+
+
+@metrics.timer('get_base_data', 'fetch')
 def get_base_data():
 
-	""" Returns data from base fpl api. """
+	""" Returns data from base fpl api. The payload is shared by all sessions and revalidated every BOOTSTRAP_TTL seconds. """
+
+	return bootstrap.get()
 
-	url = 'https://fantasy.premierleague.com/api/bootstrap-static/'
 
-	response = ''
-	while response == '':
-		try:
-			response = requests.get(url)
-		except:
-			time.sleep(5)
 
-	if response.status_code != 200:
-		raise Exception(f"Response was code {response.status_code}")
+def current_gameweek(base_data):
 
-	data = json.loads(response.text)
+	""" Returns the id of the live gameweek from the bootstrap events list, or 0 if the season has not started. """
 
-	return data 
+	for event in base_data['events']:
+		if event['is_current']:
+			return event['id']
 
+	return max((event['id'] for event in base_data['events'] if event['finished']), default=0)
 
 
+def finished_gameweek(base_data):
+
+	""" Returns the id of the latest gameweek whose scores are final, or 0 if there is none. FPL marks a gameweek
+	finished before its scores are checked, and points can still change until then, so both flags must be set. """
+
+	return max((event['id'] for event in base_data['events'] if event['finished'] and event['data_checked']), default=0)
+
+
+@metrics.timer('clean_base_events_data', 'transform')
 def clean_base_events_data(dataframe):
 
 	""" Returns a cleaned events dataframe keeping only average and highest score columns for all 
@@ -58,6 +70,9 @@ def create_lookup(base_data):
 def create_overall_visuals(df_subset):
 
 	" Returns plotly charts for showing overall graphics. "
+	# plotly is imported here so the data functions can be used without loading it
+	import plotly.express as px
+	import plotly.graph_objects as go
 
 	layout = go.Layout(
   	margin=go.layout.Margin(
@@ -85,33 +100,122 @@ def create_overall_visuals(df_subset):
 	return fig, plt
 
 
-def top_performing_players(lookup_table, events):
+def top_players_chart(top_players_df):
+
+	""" Returns horizontal bar chart of the top performing player of each gameweek. """
+	import plotly.express as px
+
+	fig = px.bar(top_players_df, x = 'points', y = 'gameweek', text='player',
+		orientation='h',
+		title="Top performing players each gameweek (by points)",
+		width = 800)
+
+	fig.update_traces(textposition='outside')
+	fig.update_layout(margin=dict(l=0,r=0,t=35,b=100))
+
+	return fig
+
+
+@metrics.timer('top_performing_players', 'transform')
+def top_performing_players(index, events):
 
 	""" Returns data frame containing name and points of top performing player of each gameweek."""
-	
-	top_players_list = list()
 
 	# check completed events only
 	events_filtered = events[~events['highest_score'].isna()]
 	# get id of top performing player of each gameweek played
-	top_elements = events_filtered['top_element'].astype(int)	
+	top_elements = events_filtered['top_element'].astype(int)
+	players = index.names(top_elements)
+	points = [info['points'] for info in events_filtered['top_element_info']]
 
-	for index, top in enumerate(top_elements):
-		player = lookup_table.loc[lookup_table.id == top, "web_name"].item()
-		points = events_filtered['top_element_info'][index]['points']
-		top_players_list.append(dict(gameweek=index+1, player=player, points=points))
-
-	return top_players_list
+	return [dict(gameweek=gameweek, player=player, points=points) for gameweek, player, points in zip(events_filtered['id'], players, points)]
 
 
+@metrics.timer('create_bubble_chart_df', 'transform')
 def create_bubble_chart_df(elements):
 
 	""" Returns data frame of players who have played at least 180 minutes and have scored at least a point,
 	with their cost and points per million information. """
 
-	bubble_chart_df = elements[['id', 'web_name', 'element_type', 'total_points', 'now_cost', 'points_per_game', 'minutes']]
+	bubble_chart_df = elements[['id', 'web_name', 'element_type', 'total_points', 'now_cost', 'points_per_game', 'minutes']].copy()
 	bubble_chart_df['now_cost'] =  bubble_chart_df['now_cost'] / 10
 	bubble_chart_df['points_per_million'] = round(bubble_chart_df['total_points'] / bubble_chart_df['now_cost'], 2)
 	bubble_chart_df = bubble_chart_df.query("total_points > 0 and minutes > 180")
 
 	return bubble_chart_df
+
+
+@cache.per_payload
+@metrics.timer('season_aggregates', 'transform')
+def season_aggregates(base_data):
+
+	""" Returns the derived season tables of a bootstrap payload, built once per payload and shared by all sessions:
+	'events' holds the average and highest score of each completed gameweek, 'top_players' the top element of each
+	gameweek and 'bubble' the cost, points and points per million of every regular player. """
+
+	events = pd.DataFrame(base_data['events'])
+	elements = pd.DataFrame(base_data['elements'])
+
+	top_players = pd.DataFrame(top_performing_players(element_index.element_index(base_data), events), columns=['gameweek', 'player', 'points'])
+
+	bubble = create_bubble_chart_df(elements)[['id', 'web_name', 'element_type', 'total_points', 'now_cost', 'points_per_million']]
+	bubble = bubble.astype(dict(id='int16', element_type='int8', total_points='int16', now_cost='float32', points_per_million='float32'))
+
+	bubble = bubble.sort_values('points_per_million', ascending=False).reset_index(drop=True)
+
+	return dict(
+		events=clean_base_events_data(events).astype('int32'),
+		top_players=top_players.astype(dict(gameweek='int8', points='int16')),
+		bubble=bubble,
+		bubble_by_position={element_type: table.reset_index(drop=True) for element_type, table in bubble.groupby('element_type')})
+
+
+def downsample_bubble(bubble_df, sampling):
+
+	""" Returns the players of a bubble chart table to plot. 'top' keeps the BUBBLE_TOP_N players with the most
+	points per million, 'density' keeps the best value player in each BUBBLE_CELL sized (cost, points) cell
+	and 'all' keeps everyone. The table must be sorted by points per million, best first. """
+
+	if sampling == 'top':
+		return bubble_df.head(BUBBLE_TOP_N)
+	if sampling == 'density':
+		cells = pd.DataFrame(dict(
+			x=(bubble_df['now_cost'] // BUBBLE_CELL[0]).astype(int),
+			y=(bubble_df['total_points'] // BUBBLE_CELL[1]).astype(int)))
+		return bubble_df[~cells.duplicated()]
+
+	return bubble_df
+
+
+@cache.per_payload
+@metrics.timer('bubble_chart_json', 'chart')
+def bubble_chart_json(base_data, element_type, sampling='all'):
+
+	""" Returns the JSON spec of the points against cost bubble chart for one position, built once per payload.
+	All players are drawn as a single WebGL trace, sized and coloured by points per million. """
+	import plotly.graph_objects as go
+
+	bubble_df = downsample_bubble(season_aggregates(base_data)['bubble_by_position'].get(element_type, pd.DataFrame(
+		columns=['web_name', 'total_points', 'now_cost', 'points_per_million'])), sampling)
+	size_max = 20
+	size_ref = 2 * max(bubble_df['points_per_million'].max(), 1) / size_max ** 2 if len(bubble_df) else 1
+
+	fig = go.Figure(go.Scattergl(
+		x=bubble_df['now_cost'],
+		y=bubble_df['total_points'],
+		text=bubble_df['web_name'],
+		mode='markers',
+		marker=dict(
+			size=bubble_df['points_per_million'],
+			sizemode='area',
+			sizeref=size_ref,
+			sizemin=2,
+			color=bubble_df['points_per_million'],
+			colorscale='Viridis',
+			showscale=True,
+			colorbar=dict(title='Points per £m')),
+		hovertemplate="<b>%{text}</b><br>Cost: £%{x}m<br>Points: %{y}<br>Points per £m: %{marker.color:.2f}<extra></extra>"))
+
+	fig.update_layout(xaxis_title='now_cost', yaxis_title='total_points', margin=dict(l=0,r=0,t=30,b=0))
+
+	return figures.figure_json(fig)
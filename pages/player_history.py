@@ -0,0 +1,157 @@
+"""
+This file contains the process-wide panel of player points. The points and minutes of every player are held
+in compact (element x gameweek) arrays filled one gameweek at a time from the event live endpoint: a finished
+gameweek is downloaded once, only the live gameweek is ever fetched again, and every manager's calculations
+gather from the same arrays.
+"""
+import time
+import threading
+import numpy as np
+import pandas as pd
+from pages import overall_utils, snapshot_store, metrics
+
+N_GAMEWEEKS = 38
+
+# seconds the live gameweek is used before it is fetched again
+LIVE_TTL = 60
+
+
+def live_arrays(live):
+
+	""" Returns the element ids and the points and minutes of each element in an event live payload. """
+	elements = live['elements']
+	ids = np.array([element['id'] for element in elements], dtype=np.int32)
+	points = np.array([element['stats']['total_points'] for element in elements], dtype=np.int16)
+	minutes = np.array([element['stats']['minutes'] for element in elements], dtype=np.int16)
+
+	return ids, points, minutes
+
+
+class PlayerPanel:
+
+	""" Points and minutes of every player in every gameweek, shared by every session in the process. Row i holds
+	element i and column 0 holds gameweek 1; gameweeks not loaded yet read as nan. """
+	def __init__(self, n_gameweeks=N_GAMEWEEKS, live_ttl=LIVE_TTL) -> None:
+		self.n_gameweeks = n_gameweeks
+		self.live_ttl = live_ttl
+		self._points = np.zeros((1, n_gameweeks), dtype=np.int16)
+		self._minutes = np.zeros((1, n_gameweeks), dtype=np.int16)
+		self._loaded = np.zeros(n_gameweeks, dtype=bool)
+		self._final = np.zeros(n_gameweeks, dtype=bool)
+		self._fetched_at = np.zeros(n_gameweeks)
+		self._lock = threading.Lock()
+		self._update_lock = threading.Lock()
+
+	def refresh(self) -> None:
+
+		""" Drops every loaded gameweek so the next lookups download them again. """
+		with self._lock:
+			self._points = np.zeros((1, self.n_gameweeks), dtype=np.int16)
+			self._minutes = np.zeros((1, self.n_gameweeks), dtype=np.int16)
+			self._loaded[:] = False
+			self._final[:] = False
+			self._fetched_at[:] = 0
+
+	def _is_stale(self, gameweek, finished_gw, now):
+		i = gameweek - 1
+		if not self._loaded[i]:
+			return True
+		if self._final[i]:
+			return False
+		return gameweek <= finished_gw or now - self._fetched_at[i] >= self.live_ttl
+
+	def update(self, current_gw=None, finished_gw=None) -> None:
+
+		""" Loads the gameweeks up to current_gw that are missing, have finished since they were loaded or are live
+		and older than live_ttl. Gameweeks default to those of the bootstrap data. Gameweeks never loaded are read
+		through the snapshot store, finished ones only from a permanent snapshot; gameweeks loaded before are fetched
+		from the API, since they were live. Each gameweek is filled in as its payload arrives. """
+		if current_gw is None:
+			base_data = overall_utils.get_base_data()
+			current_gw, finished_gw = overall_utils.current_gameweek(base_data), overall_utils.finished_gameweek(base_data)
+		finished_gw = finished_gw or 0
+
+		with self._update_lock:
+			now = time.time()
+			gameweeks = range(1, min(current_gw, self.n_gameweeks) + 1)
+			stale = [gameweek for gameweek in gameweeks if self._is_stale(gameweek, finished_gw, now)]
+			metrics.count('cache_hits_total', len(gameweeks) - len(stale), cache='player_panel')
+			metrics.count('cache_misses_total', len(stale), cache='player_panel')
+			if not stale:
+				return
+
+			ttls = [snapshot_store.PERMANENT if gameweek <= finished_gw else snapshot_store.LIVE_TTL for gameweek in stale]
+			new = [i for i, gameweek in enumerate(stale) if not self._loaded[gameweek - 1]]
+			seen = [i for i, gameweek in enumerate(stale) if self._loaded[gameweek - 1]]
+			for indices, refresh in ((new, False), (seen, True)):
+				for j, live in snapshot_store.iter_many([f'event/{stale[i]}/live/' for i in indices],
+					gameweeks=[stale[i] for i in indices], ttls=[ttls[i] for i in indices], refresh=refresh):
+					gameweek = stale[indices[j]]
+					self._fill(gameweek, *live_arrays(live), final=gameweek <= finished_gw, fetched_at=now)
+
+	def _fill(self, gameweek, ids, points, minutes, final, fetched_at) -> None:
+		with self._lock:
+			size = max(len(self._points), int(ids.max()) + 1 if len(ids) else 0)
+			if size > len(self._points):
+				self._points = np.vstack([self._points, np.zeros((size - len(self._points), self.n_gameweeks), dtype=np.int16)])
+				self._minutes = np.vstack([self._minutes, np.zeros((size - len(self._minutes), self.n_gameweeks), dtype=np.int16)])
+
+			i = gameweek - 1
+			self._points[:, i] = 0
+			self._minutes[:, i] = 0
+			self._points[ids, i] = points
+			self._minutes[ids, i] = minutes
+			self._loaded[i] = True
+			self._final[i] = final
+			self._fetched_at[i] = fetched_at
+
+	def history(self, player_id):
+
+		""" Returns the per-gameweek points array of a player. """
+		return self.points_matrix([player_id])[0]
+
+	def points(self, player_id, gameweek):
+
+		""" Returns the points a player scored in a gameweek, where gameweek 0 is the first gameweek. """
+		history = self.history(player_id)
+		gameweek = int(gameweek)
+		return history[gameweek] if 0 <= gameweek < len(history) else np.nan
+
+	def points_for(self, player_ids, gameweek):
+
+		""" Returns an array of the points each of the given players scored in a gameweek. """
+		gameweek = int(gameweek)
+		if not 0 <= gameweek < self.n_gameweeks:
+			return np.full(len(player_ids), np.nan)
+
+		return self.points_matrix(player_ids)[:, gameweek]
+
+	def points_matrix(self, player_ids):
+
+		""" Returns a (players x gameweeks) array holding the per-gameweek points of each given player. Players
+		unknown to the panel score 0 in every loaded gameweek. """
+		self.update()
+		player_ids = np.asarray(player_ids, dtype=np.int64).reshape(-1)
+		with self._lock:
+			known = (player_ids > 0) & (player_ids < len(self._points))
+			matrix = np.zeros((len(player_ids), self.n_gameweeks))
+			matrix[known] = self._points[player_ids[known]]
+			matrix[:, ~self._loaded] = np.nan
+
+		return matrix
+
+	def frame(self):
+
+		""" Returns a long data frame with one row per (element, gameweek) loaded, holding its points and minutes. """
+		self.update()
+		with self._lock:
+			gameweeks = np.flatnonzero(self._loaded)
+			elements = np.arange(1, len(self._points))
+			return pd.DataFrame(dict(
+				element=np.repeat(elements, len(gameweeks)).astype(np.int16),
+				gameweek=np.tile(gameweeks + 1, len(elements)).astype(np.int8),
+				points=self._points[1:, gameweeks].ravel(),
+				minutes=self._minutes[1:, gameweeks].ravel()))
+
+
+panel = PlayerPanel()
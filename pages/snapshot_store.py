@@ -0,0 +1,170 @@
+"""
+This file contains the on-disk snapshot store for FPL API responses. Responses are kept in a local SQLite
+database as compressed JSON, keyed by endpoint and gameweek, so a restarted process starts from disk rather
+than from the FPL API. Completed-gameweek data is stored permanently; live data is stored with an expiry, and
+expired snapshots are deleted when a process opens the store and every PURGE_INTERVAL seconds while it writes.
+"""
+import os
+import json
+import time
+import zlib
+import sqlite3
+import threading
+from pages import fpl_client, metrics
+
+# path of the SQLite database, an empty value disables the store
+DB_PATH = os.environ.get('FPL_SNAPSHOT_DB', '.fpl_snapshots.sqlite')
+
+# seconds a snapshot of live data stays valid
+LIVE_TTL = int(os.environ.get('FPL_SNAPSHOT_TTL', 600))
+
+# passed as ttl for data that never changes, such as a completed gameweek's picks
+PERMANENT = None
+
+# seconds between deletions of expired snapshots by a process writing to the store
+PURGE_INTERVAL = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+	endpoint TEXT NOT NULL,
+	gameweek INTEGER NOT NULL,
+	data BLOB NOT NULL,
+	fetched_at REAL NOT NULL,
+	expires_at REAL,
+	PRIMARY KEY (endpoint, gameweek)
+)
+"""
+
+
+class SnapshotStore:
+
+	""" SQLite-backed store of compressed JSON responses keyed by (endpoint, gameweek). """
+	def __init__(self, path=DB_PATH) -> None:
+		self.path = path
+		self._local = threading.local()
+		self._purged_at = 0.0
+
+	def _connection(self):
+
+		""" Returns this thread's connection, creating the database on first use and deleting expired snapshots when due. """
+		connection = getattr(self._local, 'connection', None)
+		if connection is None:
+			connection = sqlite3.connect(self.path, timeout=30)
+			connection.execute('PRAGMA journal_mode=WAL')
+			connection.execute(_SCHEMA)
+			self._local.connection = connection
+			self._purge_if_due()
+
+		return connection
+
+	def entry(self, endpoint, gameweek=0):
+
+		""" Returns the (data, fetched_at, expires_at) of a snapshot, expired or not, or None if there is none. """
+		row = self._connection().execute(
+			'SELECT data, fetched_at, expires_at FROM snapshots WHERE endpoint = ? AND gameweek = ?',
+			(endpoint, gameweek)).fetchone()
+		if row is None:
+			return None
+
+		return json.loads(zlib.decompress(row[0])), row[1], row[2]
+
+	def get(self, endpoint, gameweek=0, final=False):
+
+		""" Returns the data of an unexpired snapshot, or None. If final is set, only a permanent snapshot is returned,
+		so one stored while its gameweek was still live is never taken for the final data. """
+		entry = self.entry(endpoint, gameweek)
+		if entry is None or (entry[2] is not None and (final or entry[2] <= time.time())):
+			metrics.cache_hit('snapshots', False)
+			return None
+
+		metrics.cache_hit('snapshots')
+		return entry[0]
+
+	def put(self, endpoint, data, gameweek=0, ttl=LIVE_TTL, latest=False) -> None:
+
+		""" Stores a snapshot, expiring after ttl seconds or never if ttl is PERMANENT. If latest is set, the snapshots
+		of the endpoint for earlier gameweeks are deleted, for endpoints only ever read at the newest gameweek. """
+		now = time.time()
+		blob = zlib.compress(json.dumps(data, separators=(',', ':')).encode())
+		connection = self._connection()
+		with connection:
+			connection.execute(
+				'INSERT OR REPLACE INTO snapshots (endpoint, gameweek, data, fetched_at, expires_at) VALUES (?, ?, ?, ?, ?)',
+				(endpoint, gameweek, blob, now, None if ttl is PERMANENT else now + ttl))
+			if latest:
+				connection.execute('DELETE FROM snapshots WHERE endpoint = ? AND gameweek < ?', (endpoint, gameweek))
+
+		self._purge_if_due()
+
+	def purge_expired(self) -> int:
+
+		""" Deletes expired snapshots and returns how many were removed. """
+		self._purged_at = time.time()
+		connection = self._connection()
+		with connection:
+			return connection.execute(
+				'DELETE FROM snapshots WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),)).rowcount
+
+	def _purge_if_due(self) -> None:
+
+		""" Deletes expired snapshots if PURGE_INTERVAL seconds have passed since this process last did, so the
+		database does not keep every id ever looked up. """
+		if time.time() - self._purged_at >= PURGE_INTERVAL:
+			self.purge_expired()
+
+
+store = SnapshotStore(DB_PATH) if DB_PATH else None
+
+
+def get_json(path, gameweek=0, ttl=LIVE_TTL, latest=False):
+
+	""" Returns the decoded JSON of an API path, reading through the snapshot store. A path stored for good, with ttl
+	PERMANENT, is only read from a permanent snapshot. If latest is set, storing it deletes its snapshots for earlier gameweeks. """
+	if store is not None:
+		data = store.get(path, gameweek, final=ttl is PERMANENT)
+		if data is not None:
+			return data
+
+	data = fpl_client.get_json(path)
+	if store is not None:
+		store.put(path, data, gameweek, ttl, latest)
+
+	return data
+
+
+def iter_many(paths, gameweeks=None, ttls=None, return_exceptions=False, refresh=False, latest=False, **kwargs):
+
+	""" Yields (index, data) pairs for many API paths, reading through the snapshot store: stored snapshots are
+	yielded at once, then missing or expired paths as each concurrent fetch finishes. gameweeks and ttls give
+	the key and expiry of each path; a path stored for good, with ttl PERMANENT, is only read from a permanent snapshot.
+	If refresh is set, every path is fetched and its snapshot replaced. latest is passed on to each store as in get_json. """
+	paths = list(paths)
+	gameweeks = list(gameweeks) if gameweeks is not None else [0] * len(paths)
+	ttls = list(ttls) if ttls is not None else [LIVE_TTL] * len(paths)
+
+	missing = list()
+	for i, (path, gameweek, ttl) in enumerate(zip(paths, gameweeks, ttls)):
+		data = store.get(path, gameweek, final=ttl is PERMANENT) if store is not None and not refresh else None
+		if data is None:
+			missing.append(i)
+		else:
+			yield i, data
+
+	for j, data in fpl_client.iter_many([paths[i] for i in missing], return_exceptions=return_exceptions, **kwargs):
+		i = missing[j]
+		if store is not None and not isinstance(data, Exception):
+			store.put(paths[i], data, gameweeks[i], ttls[i], latest)
+		yield i, data
+
+
+def get_many(paths, gameweeks=None, ttls=None, return_exceptions=False, refresh=False, latest=False, **kwargs):
+
+	""" Returns the decoded JSON of many API paths, reading through the snapshot store and fetching
+	only the missing or expired ones, concurrently. gameweeks and ttls give the key and expiry of each path.
+	If refresh is set, every path is fetched and its snapshot replaced. latest is passed on as in get_json. """
+	paths = list(paths)
+	results = [None] * len(paths)
+	for i, data in iter_many(paths, gameweeks, ttls, return_exceptions, refresh, latest, **kwargs):
+		results[i] = data
+
+	return results
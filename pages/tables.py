@@ -0,0 +1,80 @@
+"""
+This file contains the fast path for displaying data frames. Highlights are computed as whole-column masks
+rather than by calling a function on every row, and each table is marshalled once, keyed by its name and a
+fingerprint of its data, so an unchanged table is sent from its cached bytes on each rerun instead of being
+styled and serialized again.
+"""
+import numpy as np
+import pandas as pd
+from pages import cache, metrics
+
+
+def row_styles(df, mask, style, default=''):
+
+	""" Returns a frame of css for df giving every cell of the rows in mask style and every other cell default. """
+	css = np.where(np.asarray(mask, dtype=bool), style, default)
+	return pd.DataFrame(np.repeat(css[:, np.newaxis], df.shape[1], axis=1), index=df.index, columns=df.columns)
+
+
+def cell_styles(df, rules, default=''):
+
+	""" Returns a frame of css for df from rules, a list of (mask, columns, style) triples applied in order, each giving
+	style to the given columns of the rows in mask. Cells no rule matches get default. """
+	css = np.full(df.shape, default, dtype=object)
+	for mask, columns, style in rules:
+		css[np.ix_(np.flatnonzero(np.asarray(mask, dtype=bool)), df.columns.get_indexer(columns))] = style
+
+	return pd.DataFrame(css, index=df.index, columns=df.columns)
+
+
+def styler(df, css):
+
+	""" Returns a Styler of df applying a precomputed frame of css in a single call. """
+	return df.style.apply(lambda _: css, axis=None)
+
+
+def _marshall(marshall, name, df, styles):
+
+	""" Returns the serialized Arrow proto of df styled by styles, marshalled by this Streamlit version's marshall. """
+	from streamlit.proto.Arrow_pb2 import Arrow as ArrowProto
+
+	proto = ArrowProto()
+	with metrics.timer(name, 'table'):
+		if styles is None:
+			marshall(proto, df)
+		else:
+			# a fixed uuid keeps the css of equal tables identical, so their marshalled bytes can be shared
+			marshall(proto, styler(df, styles(df)).set_uuid(name), name)
+
+	return proto.SerializeToString()
+
+
+def dataframe(container, name, df, columns=None, styles=None, cached=True):
+
+	""" Displays the given columns of df, all by default, in container. styles is a function returning a frame of css
+	for the displayed frame. The marshalled table is cached under name and the data, so styles only runs when the
+	data changes; tables shown only once, such as a partial table while it fills, pass cached False so they do not
+	push others out of the cache. If this Streamlit version does not allow sending it as is, the table is displayed normally. """
+	if columns is not None:
+		df = df[columns]
+
+	try:
+		from streamlit.proto.Arrow_pb2 import Arrow as ArrowProto
+		from streamlit.elements.arrow import marshall
+		enqueue = container._enqueue
+	except (ImportError, AttributeError):
+		return container.dataframe(df if styles is None else styler(df, styles(df)))
+
+	if not cached:
+		spec = _marshall(marshall, name, df, styles)
+	else:
+		key = ('table', name, cache.fingerprint(df))
+		spec = cache.live.get(key)
+		if spec is cache.MISSING:
+			spec = _marshall(marshall, name, df, styles)
+			cache.live.put(key, spec)
+
+	proto = ArrowProto()
+	proto.ParseFromString(spec)
+
+	return enqueue('arrow_data_frame', proto)
@@ -1,202 +1,234 @@
 import time
-import json
-import requests
-import numpy as np
 import pandas as pd
-from requests.api import head 
 import streamlit as st 
-import plotly.express as px 
-from pages import my_performance_utils, overall_utils
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from pages import my_performance_utils, overall_utils, element_index, figures, tables, fpl_client, data_graph
 
+# seconds between redraws of the captain charts while gameweeks are still arriving
+CHART_INTERVAL = 0.5
 
-def highlight(row):
 
-	""" Highlights row of data frame if row contains captain's info. """
+# columns of the squad table and of the league rankings table
+SQUAD_COLUMNS = ['player', 'multiplier', 'is_captain', 'is_vice_captain', 'points', 'effective_points']
+LEAGUE_COLUMNS = ['name', 'entry_rank', 'entry_last_rank']
 
-	if row.is_captain == True:
-		return ['background-color: orange'] * 6
-	else:
-		return ['background-color: white'] * 6
- 
-def app():
 
-	# Get basic information and tables:
-	base_data = overall_utils.get_base_data()
-	events = pd.DataFrame(base_data['events'])
-	elements = pd.DataFrame(base_data['elements'])
-	lookup_table = elements[['id', 'web_name']]
+def highlight(df):
 
-	header = st.container()
-	with header:
-		header.title("View your performance over the season")
-		fpl_id = header.text_input("Enter Your FPL ID", value = 132645)
+	""" Returns css highlighting the rows of data frame containing captain's info. """
+
+	return tables.row_styles(df, df['is_captain'], 'background-color: orange', 'background-color: white')
+
+
+def highlight_ranks(df):
+
+	""" Returns css colouring league ranks green, red or gray depending on how the rank changed. """
+
+	ranks = ['entry_rank', 'entry_last_rank']
+	return tables.cell_styles(df, [
+		(df['entry_rank'] < df['entry_last_rank'], ranks, 'background-color: green'),
+		(df['entry_rank'] > df['entry_last_rank'], ranks, 'background-color: red'),
+		(df['entry_rank'] == df['entry_last_rank'], ranks, 'background-color: gray')])
+
+
+def show_header(header, manager_info):
+
+	""" Displays a manager's name, overall rank and league rankings. """
+	header.write(f"Welcome, {manager_info['player_first_name']} {manager_info['player_last_name']}.")
+	header.write(f"You are currently ranked {manager_info['summary_overall_rank']:,} in the world.")
+
+	header.write("Here is a table depicting your performance in all of your leagues, with colours depicting how your rank changed:")
 
-		manager_info = my_performance_utils.manager_info(fpl_id)
-		header.write(f"Welcome, {manager_info['player_first_name']} {manager_info['player_last_name']}.")
-		header.write(f"You are currently ranked {manager_info['summary_overall_rank']:,} in the world.")
+	# create dataframe containing manager's rankings in all of the leagues
+	classic_leagues = pd.DataFrame(manager_info['leagues']['classic'], columns=LEAGUE_COLUMNS)
 
-		header.write("Here is a table depicting your performance in all of your leagues, with colours depicting how your rank changed:")
+	tables.dataframe(header, 'classic_leagues', classic_leagues, styles=highlight_ranks)
+	header.write("\n")
 
-		# create dataframe containing manager's rankings in all of the leagues
-		classic_leagues = pd.DataFrame(manager_info['leagues']['classic'])[['name', 'entry_rank', 'entry_last_rank']]
 
-		def highlight_ranks(x):
+def show_history(current_performance, current_data_df):
 
-			""" Helper function that applies appropriate highlights based on rank changes. """
-			# if col.entry_rank < col.entry_last_rank:
-			# 	return ['background-color: green'] * 3
-			# elif col.entry_rank > col.entry_last_rank:
-			# 	return ['background-color: red'] * 3
-			# else:
-			# 	return ['background-color: gray'] * 3
-			mask_gain = classic_leagues['entry_rank'] < classic_leagues['entry_last_rank']
-			mask_loss = classic_leagues['entry_rank'] > classic_leagues['entry_last_rank']
-			mask_same = classic_leagues['entry_rank'] == classic_leagues['entry_last_rank']
+	""" Displays table showing performance in each gameweek played so far. """
+	current_performance.header('Get a sense of your season so far:')
+	tables.dataframe(current_performance, 'history', current_data_df)
+	current_performance.write("\n")
 
-			x = pd.DataFrame('', index = classic_leagues.index, columns=classic_leagues.columns)
-			x.loc[mask_gain, ['entry_rank', 'entry_last_rank']] = 'background-color: green'
-			x.loc[mask_loss, ['entry_rank', 'entry_last_rank']] = 'background-color: red'
-			x.loc[mask_same, ['entry_rank', 'entry_last_rank']] = 'background-color: gray'
 
-			return x 
-    
-		header.dataframe(classic_leagues.style.apply(highlight_ranks, axis=None))
-		header.write("\n")
+def show_charts(visualising_performance, current_data_df, df_subset):
 
-	# Create table showing performance in each gameweek played so far
-	current_performance = st.container()
-	with current_performance:
-		manager_data = my_performance_utils.current_data(fpl_id)
-		current_data_df = pd.DataFrame(manager_data['current'])
+	""" Displays line plots of points and overall rank across the season. """
+	visualising_performance.header('Visualizing your performance:')
 
-		# cleaning up the data frame:
-		current_data_df['bank'] = current_data_df['bank'] / 10
-		current_data_df['value'] = current_data_df['value'] / 10
-		current_data_df['points_after_hits'] = current_data_df['points'] - current_data_df['event_transfers_cost']
+	# Getting overall average data
+	current_data_df = current_data_df.copy()
+	current_data_df['average_points'] = df_subset.average_score
 
-		current_performance.header('Get a sense of your season so far:')
-		current_performance.dataframe(current_data_df)
-		current_performance.write("\n")
+	# line plots of points and overall rank, rebuilt only when the manager's history changes
+	plt, plt_rank = figures.figure_cache.get_or_build('performance_charts', current_data_df,
+		lambda: my_performance_utils.performance_charts(current_data_df))
 
+	figures.plotly_chart(visualising_performance, plt)
+	figures.plotly_chart(visualising_performance, plt_rank)
+	visualising_performance.write("\n")
 
-	visualising_performance = st.container()
-	with visualising_performance:
-		visualising_performance.header('Visualizing your performance:')
-
-		# Getting overall average data
-
-
-		df_subset = overall_utils.clean_base_events_data(events)
-
-
-		current_data_df['average_points'] = df_subset.average_score
-
-		# create line plot showing points, points_after_hits and average points across the season
-		plt = px.line(current_data_df, x='event', y=['points','points_after_hits','average_points'],
-			labels={
-				"event": "Gameweek",
-				"_value": "Points",
-				"variable": "Type"
-			},
-			title = "Points across each gameweek")
-
-		# create line plot showing rank across the season
-		plt_rank = px.line(current_data_df, x = 'event', y = ['overall_rank'],
-			labels = {
-			"event": "Gameweek",
-			"_value": "Rank",
-			"variable": "Type"
-			},
-			title="Your Overall Rank")
 
-		visualising_performance.plotly_chart(plt)
-		visualising_performance.plotly_chart(plt_rank)
-		visualising_performance.write("\n")
+def show_squad(container, picks, gameweek_id, index):
 
-# Captaincy and Top Performing Players	
-	gameweek_data = st.container()
-	with gameweek_data:	
-		gameweek_data.header("Gameweek by Gameweek Performance")
-		gameweek_data.text("View the team you selected each gameweek.")
+	""" Displays the 15-man squad a manager picked in a gameweek. """
 
-		gw_data = my_performance_utils.gameweek_data(fpl_id)
-		lookup_table = elements[['id', 'web_name']]
-		CURRENT_GW = len(gw_data)
+	# get a manager's 15-man team for the gameweek
+	gw_data_df = pd.DataFrame(picks)
+	# get correct web_name of player against their ID
+	gw_data_df['player'] = index.names(gw_data_df['element'])
 
-		gameweek_id = gameweek_data.number_input("Enter Gameweek ID you want to check", min_value=1, max_value= CURRENT_GW, value = 1)
+	di_gw_data= my_performance_utils.create_display_gw_data(gw_data_df, gameweek_id)
 
-		# get a manager's 15-man team for each gameweek
-		gw_data_df = pd.DataFrame(gw_data[gameweek_id]['picks'])
-		# get correct web_name of player against their ID
-		gw_data_df['player'] = np.array([lookup_table.loc[lookup_table.id == id, "web_name"] for id in gw_data_df['element']])
+	container.text("Table is sorted based on the raw points each player gained.")
+	container.text("Row in Orange highlights your captain's performance in the week.")
+	container.text("Multipler = 0 means the player was on your bench while Multipler = 2 means\nthe player was your captain.")
+	tables.dataframe(container, 'squad', di_gw_data, SQUAD_COLUMNS, highlight)
+	container.write("\n")
 
 
-		di_gw_data= my_performance_utils.create_display_gw_data(gw_data_df, gameweek_id)
+class GameweekSection:
 
-		gameweek_data.text("Table is sorted based on the raw points each player gained.")
-		gameweek_data.text("Row in Orange highlights your captain's performance in the week.")
-		gameweek_data.text("Multipler = 0 means the player was on your bench while Multipler = 2 means\nthe player was your captain.")
-		gameweek_data.dataframe(di_gw_data.style.apply(highlight, axis=1))
-		gameweek_data.write("\n")
+	""" Displays the squad a manager picked in the selected gameweek as soon as that gameweek's picks arrive. """
+	def __init__(self, container, base_data, index) -> None:
+		container.header("Gameweek by Gameweek Performance")
+		container.text("View the team you selected each gameweek.")
 
+		CURRENT_GW = overall_utils.current_gameweek(base_data)
 
+		self.gameweek_id = int(container.number_input("Enter Gameweek ID you want to check", min_value=1, max_value= CURRENT_GW, value = 1))
+		self.index = index
+		self.squad = container.empty()
+		self.shown = False
 
-	# Captaincy:
-	captain_performances = st.container()
-	with captain_performances:
-		captain_performances.header("Your Captains' Performances")
-		caps_df, cap_fig = my_performance_utils.captain_performances(gameweek_data=gw_data, lookup_table=lookup_table, current_gw=CURRENT_GW)
+	def add(self, result) -> None:
+		if result['gameweek'] == self.gameweek_id:
+			show_squad(self.squad.container(), result['picks'], self.gameweek_id, self.index)
+			self.shown = True
 
-		# display horizontal bar chart displaying points gained by captain each gameweek
-		captain_performances.plotly_chart(cap_fig)
+	def finish(self) -> None:
+		if not self.shown:
+			self.squad.info(f"You did not pick a team in gameweek {self.gameweek_id}.")
 
-		captain_performances.write("\n")
-		captain_performances.write("Compare your weekly captain choices with the top scoring player in your team")
-		best_players = my_performance_utils.combined_df(gw_data, CURRENT_GW, lookup_table)
-		caps_df = caps_df[['gameweek', 'captain', 'points']]
-		df = pd.concat([caps_df, best_players], axis=1, join="inner")
+	def fail(self, error) -> None:
+		self.squad.error(str(error))
 
-		# display data frame showing captain and top players performances for each gameweek
-		captain_performances.dataframe(df)
 
-		fig = go.Figure()
-
-		fig.add_trace(go.Bar(x=caps_df.gameweek,
-							y=df.points,
-							name='Captain',
-							marker_color='rgb(55, 83, 109)'))
-
-		fig.add_trace(go.Bar(x=caps_df.gameweek,
-							y=df.score,
-							name='Top Player',
-							marker_color='rgb(26, 118, 255)'))
-
-		fig.update_layout(
-		title='Your Captain and Top Performers',
-		xaxis_tickfont_size=14,
-		yaxis=dict(
-			title='Points',
-			titlefont_size=16,
-			tickfont_size=14,
-		),
-		legend=dict(
-			x=0,
-			y=1.0,
-			bgcolor='rgba(255, 255, 255, 0)',
-			bordercolor='rgba(255, 255, 255, 0)'
-		),
-		barmode='group',
-		bargap=0.15, # gap between bars of adjacent location coordinates.
-		bargroupgap=0.1 # gap between bars of the same location coordinate.
-	)
-
-		# display combined barplot comparing captain and top player performance for each gameweek
-		captain_performances.plotly_chart(fig)
+class CaptainSection:
 
+	""" Displays the points scored by a manager's captains compared with their top scoring players, adding each
+	gameweek to the table as it arrives and redrawing the charts at most every CHART_INTERVAL seconds. """
+	def __init__(self, container, base_data) -> None:
+		container.header("Your Captains' Performances")
+		self.n_gameweeks = overall_utils.current_gameweek(base_data)
+		self.progress = container.progress(0)
 
+		# horizontal bar chart displaying points gained by captain each gameweek
+		self.captain_chart = container.empty()
+		container.write("\n")
+		container.write("Compare your weekly captain choices with the top scoring player in your team")
 
+		# data frame showing captain and top players performances for each gameweek
+		self.table = container.empty()
 
+		# combined barplot comparing captain and top player performance for each gameweek
+		self.comparison_chart = container.empty()
 
-	
+		self.rows = list()
+		self.drawn_at = 0
+
+	def frame(self):
+		df = pd.DataFrame(self.rows, columns=['gameweek', 'captain', 'points', 'top_player', 'score'])
+		return df.sort_values('gameweek', ignore_index=True)
+
+	def draw(self, df, cached=True) -> None:
+		caps_df = df[['captain', 'points', 'gameweek']]
+		figures.cached_chart(self.captain_chart, 'captain_chart', caps_df, lambda: my_performance_utils.captain_chart(caps_df), cached)
+		figures.cached_chart(self.comparison_chart, 'captain_comparison_chart', df, lambda: my_performance_utils.captain_comparison_chart(df), cached)
+		self.drawn_at = time.perf_counter()
+
+	def add(self, result) -> None:
+		self.rows.append({column: result[column] for column in ['gameweek', 'captain', 'points', 'top_player', 'score']})
+		self.progress.progress(min(len(self.rows) / max(self.n_gameweeks, 1), 1.0))
+
+		# partial tables and charts are shown once, so only the finished ones are cached
+		df = self.frame()
+		tables.dataframe(self.table, 'captains', df, cached=False)
+		if time.perf_counter() - self.drawn_at >= CHART_INTERVAL:
+			self.draw(df, cached=False)
+
+	def finish(self) -> None:
+		self.progress.empty()
+		if self.rows:
+			df = self.frame()
+			tables.dataframe(self.table, 'captains', df)
+			self.draw(df)
+
+	def fail(self, error) -> None:
+		self.progress.empty()
+		self.table.error(str(error))
+
+
+def app():
+
+	header = st.container()
+	header.title("View your performance over the season")
+	fpl_id = header.text_input("Enter Your FPL ID", value = 132645)
+	try:
+		fpl_id = my_performance_utils.manager_id(fpl_id)
+	except fpl_client.FPLNotFoundError as e:
+		header.error(str(e))
+		return
+
+	# start every fetch the page needs at once; each section renders as soon as the data it needs has arrived
+	with data_graph.DataGraph() as graph:
+		graph.add('base_data', overall_utils.get_base_data)
+		graph.add('manager_info', lambda: my_performance_utils.manager_info(fpl_id))
+		graph.add('history', lambda base_data: my_performance_utils.history_df(my_performance_utils.current_data(fpl_id,
+			overall_utils.current_gameweek(base_data), overall_utils.finished_gameweek(base_data))), 'base_data')
+		graph.add('index', element_index.element_index, 'base_data')
+		graph.add('events', lambda base_data: overall_utils.season_aggregates(base_data)['events'], 'base_data')
+		# each gameweek's picks and captaincy are streamed to the sections below as they arrive
+		graph.stream('gameweeks', lambda base_data, index: my_performance_utils.gameweek_results(fpl_id,
+			overall_utils.current_gameweek(base_data), overall_utils.finished_gameweek(base_data), index), 'base_data', 'index')
+
+		# containers are created in page order so each section keeps its place whatever order it renders in
+		sections = dict(
+			header=(header, show_header, ['manager_info']),
+			current_performance=(st.container(), show_history, ['history']),
+			visualising_performance=(st.container(), show_charts, ['history', 'events']),
+			gameweek_data=(st.container(), GameweekSection, ['base_data', 'index']),
+			captain_performances=(st.container(), CaptainSection, ['base_data']))
+
+		# sections taking the streamed gameweeks, by name
+		sinks = dict()
+		updates = graph.updates({name: tasks for name, (container, show, tasks) in sections.items()}, ['gameweeks'])
+		for name, item in updates:
+			if name == 'gameweeks':
+				if item is not data_graph.DataGraph.END:
+					for sink in sinks.values():
+						sink.add(item)
+					continue
+				try:
+					graph.result('gameweeks')
+				except fpl_client.FPLAPIError as e:
+					for sink in sinks.values():
+						sink.fail(e)
+				else:
+					for sink in sinks.values():
+						sink.finish()
+				continue
+
+			container, show, tasks = sections[name]
+			try:
+				inputs = [graph.result(task) for task in tasks]
+			except fpl_client.FPLAPIError as e:
+				container.error(str(e))
+				continue
+
+			with container:
+				shown = show(container, *inputs)
+			if name in ('gameweek_data', 'captain_performances'):
+				sinks[name] = shown
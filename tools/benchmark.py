@@ -0,0 +1,204 @@
+"""
+This file contains the benchmark harness for the data-preparation functions in pages/. Each function runs
+against a synthetic FPL API served by tools/replay.py and is measured for wall time, memory allocated and the
+number of HTTP calls it makes. Results can be saved as a baseline and later runs compared against it.
+
+	python -m tools.benchmark --scenario realistic --save-baseline
+	python -m tools.benchmark --scenario realistic stress --compare
+"""
+import os
+import sys
+import json
+import time
+import inspect
+import argparse
+import statistics
+import tracemalloc
+
+# benchmarks must never read from or write to the snapshot store of a real deployment
+os.environ['FPL_SNAPSHOT_DB'] = ''
+
+import pandas as pd
+from tools import replay
+from pages import fpl_client, overall_utils, my_performance_utils, element_index, player_history, manager_history, cache
+
+BASELINE_FILE = os.path.join('benchmarks', 'baseline.json')
+
+SCENARIOS = {
+	'realistic': dict(managers=10, players=600, current_gw=38),
+	'stress': dict(managers=200, players=1000, current_gw=38),
+}
+
+
+def uncached(func):
+
+	""" Returns the function underneath its timer and cache wrappers so repeated runs measure the work itself. """
+	return inspect.unwrap(func)
+
+
+def reset_caches() -> None:
+
+	""" Empties the process-wide caches so the next run starts cold. """
+	player_history.panel.refresh()
+	manager_history.store.refresh()
+	cache.live.clear()
+	overall_utils.bootstrap.invalidate()
+
+
+class Benchmarks:
+
+	""" The benchmarked functions, each run over the payloads of a synthetic scenario. """
+	def __init__(self, managers) -> None:
+		self.managers = managers
+		self.base_data = overall_utils.get_base_data()
+		self.events = pd.DataFrame(self.base_data['events'])
+		self.elements = pd.DataFrame(self.base_data['elements'])
+		self.index = element_index.element_index(self.base_data)
+		self.current_gw = overall_utils.current_gameweek(self.base_data)
+		finished_gw = overall_utils.finished_gameweek(self.base_data)
+		self.gw_data = {manager: uncached(my_performance_utils.gameweek_data)(manager, self.current_gw, finished_gw) for manager in managers}
+
+	def clean_base_events_data(self):
+		overall_utils.clean_base_events_data(self.events)
+
+	def top_performing_players(self):
+		overall_utils.top_performing_players(self.index, self.events)
+
+	def create_bubble_chart_df(self):
+		overall_utils.create_bubble_chart_df(self.elements)
+
+	def create_display_gw_data(self):
+		for gw_data in self.gw_data.values():
+			for gameweek_id in range(1, len(gw_data) + 1):
+				gw_data_df = pd.DataFrame(gw_data[gameweek_id])
+				gw_data_df['player'] = self.index.names(gw_data_df['element'])
+				uncached(my_performance_utils.create_display_gw_data)(gw_data_df, gameweek_id)
+
+	def squad_matrix(self):
+		for gw_data in self.gw_data.values():
+			uncached(my_performance_utils.squad_matrix)(gw_data)
+
+	def captain_table(self):
+		for gw_data in self.gw_data.values():
+			squad = uncached(my_performance_utils.squad_matrix)(gw_data)
+			uncached(my_performance_utils.captain_table)(squad, self.index)
+
+	names = ['clean_base_events_data', 'top_performing_players', 'create_bubble_chart_df',
+		'create_display_gw_data', 'squad_matrix', 'captain_table']
+
+
+def measure(func, server, repeats):
+
+	""" Returns the cold wall time and HTTP calls, the median warm wall time and the peak memory allocated by func. """
+	reset_caches()
+	requests_before = server.request_count
+	start = time.perf_counter()
+	func()
+	cold = time.perf_counter() - start
+	http_calls = server.request_count - requests_before
+
+	warm = list()
+	for _ in range(repeats):
+		start = time.perf_counter()
+		func()
+		warm.append(time.perf_counter() - start)
+
+	tracemalloc.start()
+	func()
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return dict(cold_s=round(cold, 6), warm_s=round(statistics.median(warm), 6), peak_kib=round(peak / 1024, 1), http_calls=http_calls)
+
+
+def run_scenario(name, repeats, only=None):
+
+	""" Runs every benchmark against a replay server serving the named scenario. """
+	params = SCENARIOS[name]
+	server = replay.ReplayServer(replay.SyntheticSource(**params)).start()
+	fpl_client.BASE_URL = server.url
+	reset_caches()
+
+	try:
+		managers = range(replay.FIRST_MANAGER_ID, replay.FIRST_MANAGER_ID + params['managers'])
+		benchmarks = Benchmarks(managers)
+		results = dict()
+		for function in Benchmarks.names:
+			if only and function not in only:
+				continue
+			results[function] = measure(getattr(benchmarks, function), server, repeats)
+	finally:
+		server.stop()
+
+	return results
+
+
+def compare(results, baseline, tolerance, min_delta):
+
+	""" Returns a list of regressions of results against a baseline. Time differences below min_delta
+	seconds are treated as noise. """
+	regressions = list()
+	for scenario, functions in results.items():
+		for function, result in functions.items():
+			base = baseline.get(scenario, {}).get(function)
+			if base is None:
+				continue
+			if result['warm_s'] > base['warm_s'] * (1 + tolerance) and result['warm_s'] - base['warm_s'] > min_delta:
+				regressions.append(f"{scenario}/{function}: warm_s {result['warm_s']} > baseline {base['warm_s']}")
+			if result['peak_kib'] > base['peak_kib'] * (1 + tolerance):
+				regressions.append(f"{scenario}/{function}: peak_kib {result['peak_kib']} > baseline {base['peak_kib']}")
+			if result['http_calls'] > base['http_calls']:
+				regressions.append(f"{scenario}/{function}: http_calls {result['http_calls']} > baseline {base['http_calls']}")
+
+	return regressions
+
+
+def print_results(results) -> None:
+	print(f"{'scenario':<10} {'function':<24} {'cold (s)':>10} {'warm (s)':>10} {'peak (KiB)':>11} {'http':>6}")
+	for scenario, functions in results.items():
+		for function, r in functions.items():
+			print(f"{scenario:<10} {function:<24} {r['cold_s']:>10.4f} {r['warm_s']:>10.4f} {r['peak_kib']:>11.1f} {r['http_calls']:>6}")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Benchmark the data-preparation functions in pages/.")
+	parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=['realistic'])
+	parser.add_argument('--function', nargs='+', choices=Benchmarks.names, help="only run these benchmarks")
+	parser.add_argument('--repeats', type=int, default=5)
+	parser.add_argument('--baseline', default=BASELINE_FILE)
+	parser.add_argument('--save-baseline', action='store_true', help="store the results as the new baseline")
+	parser.add_argument('--compare', action='store_true', help="fail if results regress against the baseline")
+	parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative slowdown or memory growth")
+	parser.add_argument('--min-delta', type=float, default=0.005, help="slowdowns smaller than this many seconds are ignored")
+	parser.add_argument('--json', help="also write the results to this file")
+	args = parser.parse_args()
+
+	results = {scenario: run_scenario(scenario, args.repeats, args.function) for scenario in args.scenario}
+	print_results(results)
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent=2)
+
+	if args.save_baseline:
+		baseline = dict()
+		if os.path.exists(args.baseline):
+			with open(args.baseline) as f:
+				baseline = json.load(f)
+		for scenario, functions in results.items():
+			baseline.setdefault(scenario, {}).update(functions)
+		os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+		with open(args.baseline, 'w') as f:
+			json.dump(baseline, f, indent=2, sort_keys=True)
+
+	if args.compare:
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f), args.tolerance, args.min_delta)
+		for regression in regressions:
+			print("REGRESSION", regression)
+		if regressions:
+			sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,69 @@
+"""
+This file contains the startup-time report. Each page module is imported in a fresh interpreter, after the
+modules every worker loads anyway, and the extra import time it costs is printed with its heaviest imports.
+
+	python -m tools.import_report
+	python -m tools.import_report pages.overall --top 15
+"""
+import sys
+import argparse
+import subprocess
+
+PAGES = ['pages.overall', 'pages.your_performance', 'pages.league']
+
+# imported by app.py before any page is selected
+PRELOADED = ['streamlit', 'multipage']
+
+_TIMER = """
+import time
+{preload}
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def import_seconds(module, preload=PRELOADED):
+
+	""" Returns the seconds spent importing module in a fresh interpreter that has already imported preload. """
+	code = _TIMER.format(module=module, preload='\n'.join(f'import {name}' for name in preload))
+	result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+
+	return float(result.stdout.strip().splitlines()[-1])
+
+
+def heaviest_imports(module, top, preload=PRELOADED):
+
+	""" Returns the (cumulative microseconds, module) of the heaviest imports made directly by module. """
+	code = '\n'.join(f'import {name}' for name in preload) + f'\nimport sys; sys.stderr.write("--\\n")\nimport {module}'
+	result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True, check=True)
+
+	lines = result.stderr.split('--\n', 1)[-1].splitlines()
+	imports = list()
+	for line in lines:
+		if not line.startswith('import time:') or 'self [us]' in line:
+			continue
+		_, cumulative, name = line[len('import time:'):].split('|')
+		# names are indented two spaces per level below the page module itself
+		depth = (len(name) - len(name.lstrip()) - 1) // 2
+		if depth == 1:
+			imports.append((int(cumulative), name.strip()))
+
+	return sorted(imports, reverse=True)[:top]
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Report the import cost of each page module.")
+	parser.add_argument('modules', nargs='*', default=PAGES)
+	parser.add_argument('--top', type=int, default=5, help="number of heaviest imports to list per page")
+	args = parser.parse_args()
+
+	print(f"Baseline: {', '.join(PRELOADED)} already imported")
+	for module in args.modules:
+		print(f"{module:<28} {import_seconds(module):8.3f}s")
+		for cumulative, name in heaviest_imports(module, args.top):
+			print(f"    {name:<40} {cumulative / 1e6:8.3f}s")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,388 @@
+"""
+This file contains the load-test harness used to size deployments. It starts one Streamlit worker running app.py
+against the local FPL API stand-in in tools/replay.py and drives it headlessly over the same websocket protocol
+the browser uses: many simulated sessions connect at once, pick pages, enter FPL and league ids and change the
+gameweek and position widgets, each change being one rerun of the script. It reports throughput, rerun latency
+percentiles, the growth of the worker's memory and how many requests the worker sent to the API.
+
+	python -m tools.loadtest --sessions 50 --concurrency 10 --actions 8
+	python -m tools.loadtest --sessions 200 --concurrency 50 --latency 0.05 --json results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import subprocess
+import statistics
+import urllib.request
+
+# load tests must never read from or write to the snapshot store of a real deployment
+os.environ['FPL_SNAPSHOT_DB'] = ''
+
+from tools import replay
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# labels of the widgets the simulated sessions use
+NAVIGATION = 'App Naviagaton'
+FPL_ID = 'Enter Your FPL ID'
+GAMEWEEK = 'Enter Gameweek ID you want to check'
+POSITION = 'Select Player Position:'
+SAMPLING = 'Players shown:'
+LEAGUE_ID = 'Enter Classic League ID'
+
+# how often each page is picked, and the widgets changed on it; a page without widgets is only opened
+PAGE_WEIGHTS = {'Overall Data': 2, 'My Performance': 5, 'League Analytics': 1}
+PAGE_WIDGETS = {'Overall Data': [POSITION, SAMPLING], 'My Performance': [FPL_ID, GAMEWEEK], 'League Analytics': [LEAGUE_ID]}
+
+# seconds between samples of the worker's memory
+MEMORY_INTERVAL = 0.5
+
+# seconds the worker has to start serving
+STARTUP_TIMEOUT = 60
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def free_port():
+	with socket.socket() as s:
+		s.bind(('127.0.0.1', 0))
+		return s.getsockname()[1]
+
+
+def rss(pid):
+
+	""" Returns the resident memory of a process in bytes, or None where /proc is not available. """
+	try:
+		with open(f'/proc/{pid}/status') as f:
+			for line in f:
+				if line.startswith('VmRSS:'):
+					return int(line.split()[1]) * 1024
+	except OSError:
+		return None
+
+
+class Worker:
+
+	""" A Streamlit worker running app.py in a subprocess, pointed at api_url. """
+	def __init__(self, api_url, port=None, log=None) -> None:
+		self.port = port or free_port()
+		env = dict(os.environ, FPL_API_URL=api_url)
+		self.log = open(log, 'w') if log else subprocess.DEVNULL
+		self.process = subprocess.Popen([sys.executable, '-m', 'streamlit', 'run', 'app.py',
+			'--server.headless', 'true', '--server.port', str(self.port), '--server.fileWatcherType', 'none',
+			'--browser.gatherUsageStats', 'false'], cwd=ROOT, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+		self.stream_url = self._wait_until_serving()
+
+	def _wait_until_serving(self):
+
+		""" Waits for the health check to answer and returns the websocket url of the worker. Newer Streamlit
+		versions serve their endpoints under /_stcore/. """
+		deadline = time.time() + STARTUP_TIMEOUT
+		while time.time() < deadline:
+			if self.process.poll() is not None:
+				raise RuntimeError(f"Streamlit worker exited with code {self.process.returncode}")
+			for health, stream in (('_stcore/health', '_stcore/stream'), ('healthz', 'stream')):
+				try:
+					with urllib.request.urlopen(f'http://127.0.0.1:{self.port}/{health}', timeout=1) as response:
+						if response.status == 200:
+							return f'ws://127.0.0.1:{self.port}/{stream}'
+				except OSError:
+					pass
+			time.sleep(0.2)
+
+		self.stop()
+		raise RuntimeError(f"Streamlit worker did not start serving within {STARTUP_TIMEOUT}s")
+
+	def rss(self):
+		return rss(self.process.pid)
+
+	def stop(self) -> None:
+		self.process.terminate()
+		try:
+			self.process.wait(10)
+		except subprocess.TimeoutExpired:
+			self.process.kill()
+		if self.log is not subprocess.DEVNULL:
+			self.log.close()
+
+
+class Session:
+
+	""" One simulated browser session. Each rerun sends the values of the widgets it has changed, as the browser
+	does, and reads the script's output until the run finishes, keeping the widgets it showed by label. """
+	def __init__(self, url, timeout) -> None:
+		self.url = url
+		self.timeout = timeout
+		self.widgets = dict()
+		self.values = dict()
+		self._connection = None
+
+	async def connect(self) -> None:
+		from tornado.websocket import websocket_connect
+
+		self._connection = await websocket_connect(self.url, max_message_size=1 << 30)
+
+	def close(self) -> None:
+		if self._connection is not None:
+			self._connection.close()
+
+	def set(self, label, value) -> bool:
+
+		""" Sets the widget shown with label to value, a selectbox option index, text or number. Returns False if
+		the last run did not show that widget. """
+		widget = self.widgets.get(label)
+		if widget is None:
+			return False
+
+		kind, proto = widget
+		if kind == 'number_input':
+			field = 'int_value' if proto.data_type == proto.INT else 'double_value'
+		else:
+			field = dict(selectbox='int_value', text_input='string_value').get(kind, 'string_value')
+		self.values[proto.id] = (field, value)
+		return True
+
+	def value(self, label):
+
+		""" Returns the value of the widget shown with label, the option itself for a selectbox, or None if the last
+		run did not show it. """
+		widget = self.widgets.get(label)
+		if widget is None:
+			return None
+
+		kind, proto = widget
+		value = self.values.get(proto.id, (None, proto.default))[1]
+		return proto.options[value] if kind == 'selectbox' else value
+
+	async def rerun(self):
+
+		""" Reruns the script with the session's widget values and returns the seconds until the run finished, the
+		number of exceptions it raised and the number of errors it displayed. """
+		from streamlit.proto.BackMsg_pb2 import BackMsg
+		from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+		message = BackMsg()
+		message.rerun_script.SetInParent()
+		for id, (field, value) in self.values.items():
+			state = message.rerun_script.widget_states.widgets.add()
+			state.id = id
+			setattr(state, field, value)
+
+		start = time.perf_counter()
+		await self._connection.write_message(message.SerializeToString(), binary=True)
+
+		widgets, exceptions, errors = dict(), 0, 0
+		while True:
+			data = await asyncio.wait_for(self._connection.read_message(), self.timeout)
+			if data is None:
+				raise ConnectionError("Streamlit worker closed the session")
+
+			msg = ForwardMsg()
+			msg.ParseFromString(data)
+			kind = msg.WhichOneof('type')
+			if kind == 'delta' and msg.delta.WhichOneof('type') == 'new_element':
+				element = msg.delta.new_element
+				element_kind = element.WhichOneof('type')
+				if element_kind == 'exception':
+					exceptions += 1
+				elif element_kind == 'alert' and element.alert.format == element.alert.ERROR:
+					errors += 1
+				elif element_kind in ('selectbox', 'text_input', 'number_input'):
+					proto = getattr(element, element_kind)
+					widgets[proto.label] = (element_kind, proto)
+
+			# runs cut short by a newer rerun request are followed by that rerun; older versions call it report_finished
+			elif kind in ('script_finished', 'report_finished') and getattr(msg, kind) != 2:
+				break
+
+		seconds = time.perf_counter() - start
+		self.widgets = widgets
+		shown = {proto.id for _, proto in widgets.values()}
+		self.values = {id: value for id, value in self.values.items() if id in shown}
+
+		return seconds, exceptions, errors
+
+
+def random_value(rng, label, proto, managers, leagues):
+
+	""" Returns a random value for the widget shown with label. """
+	if label == FPL_ID:
+		return str(rng.randint(replay.FIRST_MANAGER_ID, replay.FIRST_MANAGER_ID + managers - 1))
+	if label == LEAGUE_ID:
+		return str(rng.randint(1, leagues))
+	if label == GAMEWEEK:
+		return rng.randint(int(proto.min), int(proto.max))
+
+	return rng.randrange(len(proto.options))
+
+
+async def run_session(number, url, args, results) -> None:
+
+	""" Opens the app, then picks a page and changes one of its widgets args.actions times, recording every rerun. """
+	rng = random.Random(args.seed * 1000003 + number)
+	session = Session(url, args.timeout)
+	pages, weights = list(PAGE_WEIGHTS), list(PAGE_WEIGHTS.values())
+
+	async def rerun(page, action):
+		try:
+			seconds, exceptions, errors = await session.rerun()
+		except (asyncio.TimeoutError, ConnectionError) as e:
+			results.append(dict(page=page, action=action, seconds=None, exceptions=0, errors=0, failure=type(e).__name__))
+			return False
+		results.append(dict(page=page, action=action, seconds=seconds, exceptions=exceptions, errors=errors, failure=None))
+		return True
+
+	try:
+		await session.connect()
+		if not await rerun('Overall Data', 'open'):
+			return
+
+		for _ in range(args.actions):
+			await asyncio.sleep(rng.uniform(0, 2 * args.think))
+			page = rng.choices(pages, weights)[0]
+			if session.value(NAVIGATION) != page:
+				session.set(NAVIGATION, list(session.widgets[NAVIGATION][1].options).index(page))
+				if not await rerun(page, 'navigate'):
+					return
+
+			label = rng.choice(PAGE_WIDGETS[page])
+			widget = session.widgets.get(label)
+			if widget is not None:
+				session.set(label, random_value(rng, label, widget[1], args.managers, replay.N_LEAGUES))
+				if not await rerun(page, label):
+					return
+	finally:
+		session.close()
+
+
+async def drive(url, args, worker, results):
+
+	""" Runs args.sessions sessions, at most args.concurrency at a time, sampling the worker's memory meanwhile.
+	Returns the memory samples. """
+	slots = asyncio.Semaphore(args.concurrency)
+	samples = [worker.rss()]
+
+	async def limited(number):
+		async with slots:
+			await run_session(number, url, args, results)
+
+	async def sample():
+		while True:
+			await asyncio.sleep(MEMORY_INTERVAL)
+			samples.append(worker.rss())
+
+	sampler = asyncio.ensure_future(sample())
+	try:
+		await asyncio.gather(*(limited(number) for number in range(args.sessions)))
+	finally:
+		sampler.cancel()
+	samples.append(worker.rss())
+
+	return samples
+
+
+def percentiles(values):
+	if not values:
+		return {f'p{p}': None for p in PERCENTILES}
+	ordered = sorted(values)
+	return {f'p{p}': ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))] for p in PERCENTILES}
+
+
+def summarize(results, seconds, samples, requests, sessions):
+
+	""" Returns the throughput, latency, error, memory and request figures of a run. """
+	done = [result['seconds'] for result in results if result['seconds'] is not None]
+	memory = [sample for sample in samples if sample is not None]
+
+	summary = dict(
+		sessions=sessions,
+		reruns=len(done),
+		failures=sum(result['failure'] is not None for result in results),
+		exceptions=sum(result['exceptions'] for result in results),
+		errors=sum(result['errors'] for result in results),
+		seconds=seconds,
+		reruns_per_second=len(done) / seconds if seconds else None,
+		latency=dict(mean=statistics.mean(done) if done else None, max=max(done, default=None), **percentiles(done)),
+		pages={page: dict(reruns=len(times), **percentiles(times))
+			for page in PAGE_WEIGHTS for times in [[result['seconds'] for result in results if result['page'] == page and result['seconds'] is not None]]},
+		memory=dict(start=memory[0], peak=max(memory), end=memory[-1], growth=memory[-1] - memory[0]) if memory else None,
+		requests=requests,
+		requests_per_rerun=requests / len(done) if requests is not None and done else None)
+
+	return summary
+
+
+def report(summary) -> None:
+
+	""" Prints a summary of a load test. """
+	def ms(value):
+		return '-' if value is None else f'{value * 1000:.0f}ms'
+
+	def mb(value):
+		return '-' if value is None else f'{value / 2 ** 20:.1f} MiB'
+
+	def rate(value):
+		return '-' if value is None else f'{value:.2f}'
+
+	latency = summary['latency']
+	print(f"{summary['sessions']} sessions, {summary['reruns']} reruns in {summary['seconds']:.1f}s: "
+		f"{rate(summary['reruns_per_second'])} reruns/s")
+	print(f"failures {summary['failures']}, exceptions {summary['exceptions']}, displayed errors {summary['errors']}")
+	print("latency   " + '  '.join(f"{name} {ms(latency[name])}" for name in ['mean'] + [f'p{p}' for p in PERCENTILES] + ['max']))
+	for page, figures in summary['pages'].items():
+		print(f"  {page:<18}{figures['reruns']:>6} reruns  " + '  '.join(f"p{p} {ms(figures[f'p{p}'])}" for p in PERCENTILES))
+
+	memory = summary['memory']
+	if memory:
+		print(f"memory    start {mb(memory['start'])}  peak {mb(memory['peak'])}  end {mb(memory['end'])}  growth {mb(memory['growth'])}")
+	if summary['requests'] is not None:
+		print(f"API requests {summary['requests']} ({rate(summary['requests_per_rerun'])} per rerun)")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Drive a Streamlit worker with many simulated sessions.")
+	parser.add_argument('--sessions', type=int, default=20, help="sessions run in total")
+	parser.add_argument('--concurrency', type=int, default=10, help="sessions connected at once")
+	parser.add_argument('--actions', type=int, default=6, help="pages picked by each session after opening the app")
+	parser.add_argument('--think', type=float, default=0.0, help="mean seconds a session waits between actions")
+	parser.add_argument('--timeout', type=float, default=120.0, help="seconds a rerun may take before it counts as failed")
+	parser.add_argument('--managers', type=int, default=100, help="synthetic managers served, and the range of FPL ids entered")
+	parser.add_argument('--players', type=int, default=600)
+	parser.add_argument('--current-gw', type=int, default=replay.N_GAMEWEEKS)
+	parser.add_argument('--latency', type=float, default=0.0, help="seconds the API stand-in adds to every response")
+	parser.add_argument('--jitter', type=float, default=0.0, help="maximum random seconds added on top of latency")
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--port', type=int, help="port of the Streamlit worker, a free one by default")
+	parser.add_argument('--log', help="file the worker's output is written to")
+	parser.add_argument('--json', help="file the summary is written to as JSON")
+	args = parser.parse_args()
+
+	server = replay.ReplayServer(replay.SyntheticSource(managers=args.managers, players=args.players,
+		current_gw=args.current_gw, seed=args.seed), latency=args.latency, jitter=args.jitter, seed=args.seed).start()
+	worker = Worker(server.url, args.port, args.log)
+	try:
+		results = list()
+		start = time.perf_counter()
+		samples = asyncio.run(drive(worker.stream_url, args, worker, results))
+		seconds = time.perf_counter() - start
+	finally:
+		worker.stop()
+		server.stop()
+
+	summary = summarize(results, seconds, samples, server.request_count, args.sessions)
+	# written first, so the figures of a run are kept even if printing them fails
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(summary, f, indent=2)
+	report(summary)
+
+	sys.exit(1 if summary['failures'] else 0)
+
+
+if __name__ == '__main__':
+	main()
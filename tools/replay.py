@@ -0,0 +1,454 @@
+"""
+This file contains a local stand-in for the FPL API used for offline, reproducible benchmarking and load testing.
+It serves recorded fixtures from a directory, or synthetic payloads for any number of managers and players,
+with configurable latency and error injection.
+
+	python -m tools.replay generate fixtures/ --managers 50 --players 600
+	python -m tools.replay serve fixtures/ --port 8765 --latency 0.05 --error-rate 0.01
+	python -m tools.replay serve --synthetic --managers 1000 --port 8765
+	python -m tools.replay record fixtures/ --ids 132645
+
+Point the app at it with FPL_API_URL=http://localhost:8765/api/ (and a separate FPL_SNAPSHOT_DB).
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import argparse
+import functools
+import threading
+import numpy as np
+from urllib.parse import parse_qsl
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+N_GAMEWEEKS = 38
+FIRST_MANAGER_ID = 1
+N_LEAGUES = 5
+STANDINGS_PAGE_SIZE = 50
+SQUAD_SHAPE = {1: 2, 2: 5, 3: 5, 4: 3}
+STARTING_SHAPE = {1: 1, 2: 4, 3: 4, 4: 2}
+
+
+def fixture_file(root, path):
+
+	""" Returns the fixture file storing an API path such as 'entry/1/history/'. A query string is stored
+	as a last path segment. """
+	path, _, query = path.partition('?')
+	return os.path.join(root, path.strip('/') + ('/' + query if query else '') + '.json')
+
+
+class FixtureSource:
+
+	""" Serves payloads recorded as JSON files under a directory, one file per API path. """
+	def __init__(self, root) -> None:
+		self.root = root
+
+	def get(self, path):
+		try:
+			with open(fixture_file(self.root, path)) as f:
+				return json.load(f)
+		except FileNotFoundError:
+			return None
+
+
+class SyntheticSource:
+
+	""" Generates deterministic FPL payloads for any number of managers and players. Manager ids run from
+	FIRST_MANAGER_ID to FIRST_MANAGER_ID + managers - 1; gameweeks up to current_gw have been played.
+	Classic league k, for k from 1 to N_LEAGUES, holds every k-th manager. """
+	def __init__(self, managers=10, players=600, current_gw=N_GAMEWEEKS, teams=20, seed=0) -> None:
+		self.managers = managers
+		self.players = players
+		self.current_gw = current_gw
+		self.n_teams = teams
+		self.seed = seed
+
+		rng = np.random.default_rng(seed)
+		self.element_type = rng.choice([1, 2, 3, 4], size=players, p=[0.1, 0.33, 0.4, 0.17])
+		self.element_type[:8] = [1, 1, 2, 2, 3, 3, 4, 4]
+		self.team = rng.integers(1, teams + 1, size=players)
+		self.now_cost = rng.integers(40, 130, size=players)
+		self.minutes = rng.integers(0, 91, size=(players, N_GAMEWEEKS))
+		self.points = np.where(self.minutes > 0, rng.poisson(2.5, size=(players, N_GAMEWEEKS)) + (self.minutes >= 60), 0)
+		self.points[:, current_gw:] = 0
+		self.minutes[:, current_gw:] = 0
+		self.by_position = {position: [int(e) + 1 for e in np.flatnonzero(self.element_type == position)] for position in SQUAD_SHAPE}
+
+	def _rng(self, *key):
+
+		""" Returns a random generator seeded by key, stable across processes. """
+		return random.Random(repr((self.seed,) + key))
+
+	def bootstrap(self):
+		events = list()
+		for gw in range(1, N_GAMEWEEKS + 1):
+			played = gw <= self.current_gw
+			top = int(np.argmax(self.points[:, gw - 1]))
+			events.append(dict(
+				id=gw,
+				name=f"Gameweek {gw}",
+				average_entry_score=int(self.points[:, gw - 1].mean() * 11) if played else 0,
+				highest_score=int(self.points[top, gw - 1] * 11) if played else None,
+				top_element=top + 1 if played else None,
+				top_element_info=dict(id=top + 1, points=int(self.points[top, gw - 1])) if played else None,
+				is_previous=gw == self.current_gw - 1,
+				is_current=gw == self.current_gw,
+				is_next=gw == self.current_gw + 1,
+				finished=gw < self.current_gw,
+				data_checked=gw < self.current_gw))
+
+		total_points = self.points.sum(axis=1)
+		minutes = self.minutes.sum(axis=1)
+		elements = [dict(
+			id=i + 1,
+			web_name=f"Player{i + 1}",
+			element_type=int(self.element_type[i]),
+			team=int(self.team[i]),
+			now_cost=int(self.now_cost[i]),
+			total_points=int(total_points[i]),
+			event_points=int(self.points[i, self.current_gw - 1]) if self.current_gw else 0,
+			points_per_game=str(round(total_points[i] / max(self.current_gw, 1), 1)),
+			minutes=int(minutes[i])) for i in range(self.players)]
+
+		return dict(
+			events=events,
+			elements=elements,
+			element_types=[dict(id=k, singular_name_short=name) for k, name in zip(range(1, 5), ['GKP', 'DEF', 'MID', 'FWD'])],
+			teams=[dict(id=k, name=f"Team {k}", short_name=f"T{k:02d}") for k in range(1, self.n_teams + 1)])
+
+	@functools.lru_cache(maxsize=4096)
+	def _squads(self, manager):
+
+		""" Returns the 15 element ids a manager picked in each played gameweek, changing one player a week. """
+		rng = self._rng('squad', manager)
+		squad = [e for position, count in SQUAD_SHAPE.items() for e in rng.sample(self.by_position[position], count)]
+		squads = [list(squad)]
+		for week in range(2, self.current_gw + 1):
+			rng = self._rng('transfer', manager, week)
+			slot = rng.randrange(len(squad))
+			candidates = [e for e in self.by_position[self.element_type[squad[slot] - 1]] if e not in squad]
+			if candidates:
+				squad[slot] = rng.choice(candidates)
+			squads.append(list(squad))
+
+		return squads
+
+	def _picks(self, manager, gw):
+		squad = self._squads(manager)[gw - 1]
+		starters = [e for position, count in STARTING_SHAPE.items() for e in [s for s in squad if self.element_type[s - 1] == position][:count]]
+		bench = [e for e in squad if e not in starters]
+		captain, vice = self._rng('captain', manager, gw).sample(starters, 2)
+
+		return [dict(
+			element=element,
+			position=slot + 1,
+			multiplier=(2 if element == captain else 1) if slot < 11 else 0,
+			is_captain=element == captain,
+			is_vice_captain=element == vice) for slot, element in enumerate(starters + bench)]
+
+	@functools.lru_cache(maxsize=4096)
+	def _gameweek_history(self, manager):
+		rows, total, rank = list(), 0, self._rng('rank', manager).randrange(1, 5_000_000)
+		for gw in range(1, self.current_gw + 1):
+			picks = self._picks(manager, gw)
+			points = sum(int(self.points[p['element'] - 1, gw - 1]) * p['multiplier'] for p in picks)
+			bench = sum(int(self.points[p['element'] - 1, gw - 1]) for p in picks if p['multiplier'] == 0)
+			rng = self._rng('history', manager, gw)
+			transfers = rng.choice([0, 1, 1, 2])
+			cost = 4 * max(0, transfers - 1)
+			total += points - cost
+			rank = max(1, int(rank * rng.uniform(0.7, 1.3)))
+			rows.append(dict(
+				event=gw, points=points, total_points=total, rank=rng.randrange(1, 8_000_000), overall_rank=rank,
+				bank=rng.randrange(0, 30), value=1000 + gw * 2, event_transfers=transfers,
+				event_transfers_cost=cost, points_on_bench=bench))
+
+		return rows
+
+	def _is_manager(self, manager):
+		return FIRST_MANAGER_ID <= manager < FIRST_MANAGER_ID + self.managers
+
+	@functools.lru_cache(maxsize=N_LEAGUES)
+	def _league_table(self, league):
+
+		""" Returns the standings rows of a classic league, ordered by total points. """
+		members = range(FIRST_MANAGER_ID, FIRST_MANAGER_ID + self.managers, league)
+		totals = {manager: self._gameweek_history(manager)[-1] if self.current_gw else dict(total_points=0, points=0) for manager in members}
+		order = sorted(members, key=lambda manager: -totals[manager]['total_points'])
+
+		return [dict(
+			id=manager, entry=manager, entry_name=f"Team {manager}", player_name=f"Manager {manager}",
+			rank=rank, last_rank=rank, rank_sort=rank, total=totals[manager]['total_points'],
+			event_total=totals[manager]['points']) for rank, manager in enumerate(order, start=1)]
+
+	def standings(self, league, page):
+		table = self._league_table(league)
+		start = (page - 1) * STANDINGS_PAGE_SIZE
+
+		return dict(
+			league=dict(id=league, name=f"League {league}", scoring='c'),
+			new_entries=dict(has_next=False, page=1, results=[]),
+			standings=dict(has_next=start + STANDINGS_PAGE_SIZE < len(table), page=page, results=table[start:start + STANDINGS_PAGE_SIZE]))
+
+	def get(self, path):
+
+		""" Returns the payload of an API path, or None if it does not exist. """
+		path, _, query = path.partition('?')
+		parts = path.strip('/').split('/')
+
+		if parts == ['bootstrap-static']:
+			return self.bootstrap()
+
+		if len(parts) == 3 and parts[0] == 'leagues-classic' and parts[2] == 'standings':
+			league = int(parts[1])
+			if not 1 <= league <= N_LEAGUES:
+				return None
+			page = dict(parse_qsl(query)).get('page_standings', '1')
+			return self.standings(league, max(1, int(page)))
+
+		if len(parts) == 2 and parts[0] == 'element-summary':
+			element = int(parts[1])
+			if not 1 <= element <= self.players:
+				return None
+			return dict(fixtures=[], history_past=[], history=[dict(
+				element=element, round=gw, total_points=int(self.points[element - 1, gw - 1]),
+				minutes=int(self.minutes[element - 1, gw - 1])) for gw in range(1, self.current_gw + 1)])
+
+		if len(parts) == 3 and parts[0] == 'event' and parts[2] == 'live':
+			gw = int(parts[1])
+			if not 1 <= gw <= N_GAMEWEEKS:
+				return None
+			return dict(elements=[dict(id=i + 1, stats=dict(minutes=int(self.minutes[i, gw - 1]), total_points=int(self.points[i, gw - 1])),
+				explain=[]) for i in range(self.players)])
+
+		if parts[0] != 'entry' or len(parts) < 2 or not self._is_manager(int(parts[1])):
+			return None
+		manager = int(parts[1])
+
+		if len(parts) == 2:
+			history = self._gameweek_history(manager)
+			return dict(
+				id=manager,
+				player_first_name="Manager",
+				player_last_name=str(manager),
+				started_event=1,
+				summary_overall_points=history[-1]['total_points'] if history else 0,
+				summary_overall_rank=history[-1]['overall_rank'] if history else None,
+				leagues=dict(classic=[dict(id=k, name=f"League {k}", entry_rank=self._rng('league', manager, k).randrange(1, 500),
+					entry_last_rank=self._rng('league', manager, k, 'last').randrange(1, 500))
+					for k in range(1, N_LEAGUES + 1) if (manager - FIRST_MANAGER_ID) % k == 0]))
+
+		if parts[2:] == ['history']:
+			return dict(current=self._gameweek_history(manager), past=[], chips=[])
+
+		if len(parts) == 5 and parts[2] == 'event' and parts[4] == 'picks':
+			gw = int(parts[3])
+			if not 1 <= gw <= self.current_gw:
+				return None
+			return dict(active_chip=None, automatic_subs=[], entry_history=self._gameweek_history(manager)[gw - 1], picks=self._picks(manager, gw))
+
+		return None
+
+	def paths(self):
+
+		""" Returns every API path this source serves. """
+		yield 'bootstrap-static/'
+		for element in range(1, self.players + 1):
+			yield f'element-summary/{element}/'
+		for gw in range(1, self.current_gw + 1):
+			yield f'event/{gw}/live/'
+		for manager in range(FIRST_MANAGER_ID, FIRST_MANAGER_ID + self.managers):
+			yield f'entry/{manager}/'
+			yield f'entry/{manager}/history/'
+			for gw in range(1, self.current_gw + 1):
+				yield f'entry/{manager}/event/{gw}/picks/'
+		for league in range(1, N_LEAGUES + 1):
+			for page in range(1, max(1, -(-len(self._league_table(league)) // STANDINGS_PAGE_SIZE)) + 1):
+				yield f'leagues-classic/{league}/standings/?page_standings={page}'
+
+
+class ReplayServer(ThreadingHTTPServer):
+
+	""" HTTP server answering FPL API paths under /api/ from a fixture or synthetic source. Each request
+	waits latency seconds (plus up to jitter seconds) and fails with error_status with probability error_rate. """
+	daemon_threads = True
+	request_queue_size = 128
+
+	def __init__(self, source, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=500, seed=0) -> None:
+		super().__init__((host, port), ReplayHandler)
+		self.source = source
+		self.latency = latency
+		self.jitter = jitter
+		self.error_rate = error_rate
+		self.error_status = error_status
+		self.request_count = 0
+		self.bytes_sent = 0
+		self._random = random.Random(seed)
+		self._lock = threading.Lock()
+		self._cache = dict()
+
+	@property
+	def url(self):
+		host, port = self.server_address[:2]
+		return f'http://{host}:{port}/api/'
+
+	def body(self, path):
+
+		""" Returns the encoded body and ETag of an API path, or None. Bodies are built once per path. """
+		with self._lock:
+			if path in self._cache:
+				return self._cache[path]
+
+		try:
+			data = self.source.get(path)
+		except ValueError:
+			data = None
+		body = None if data is None else json.dumps(data, separators=(',', ':')).encode()
+		result = None if body is None else (body, '"' + hashlib.md5(body).hexdigest() + '"')
+		with self._lock:
+			self._cache[path] = result
+
+		return result
+
+	def start(self):
+
+		""" Serves requests on a background thread and returns the server. """
+		threading.Thread(target=self.serve_forever, daemon=True).start()
+		return self
+
+	def stop(self) -> None:
+		self.shutdown()
+		self.server_close()
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+
+	# keep connections alive so the client's connection pool is exercised as it is against the real API
+	protocol_version = 'HTTP/1.1'
+	disable_nagle_algorithm = True
+
+	def do_GET(self) -> None:
+		server = self.server
+		with server._lock:
+			server.request_count += 1
+			fail = server._random.random() < server.error_rate
+			delay = server.latency + server._random.uniform(0, server.jitter)
+
+		if delay:
+			time.sleep(delay)
+
+		path = self.path
+		if fail:
+			return self._send(server.error_status, b'{}')
+		if not path.startswith('/api/'):
+			return self._send(404, b'{"detail":"Not found."}')
+
+		result = server.body(path[len('/api/'):])
+		if result is None:
+			return self._send(404, b'{"detail":"Not found."}')
+
+		body, etag = result
+		if self.headers.get('If-None-Match') == etag:
+			return self._send(304, b'', etag)
+
+		self._send(200, body, etag)
+
+	def _send(self, status, body, etag=None) -> None:
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		if etag:
+			self.send_header('ETag', etag)
+		self.end_headers()
+		self.wfile.write(body)
+		with self.server._lock:
+			self.server.bytes_sent += len(body)
+
+	def log_message(self, format, *args) -> None:
+		pass
+
+
+def generate_fixtures(root, source):
+
+	""" Writes every payload of a source to fixture files under root. """
+	for path in source.paths():
+		file = fixture_file(root, path)
+		os.makedirs(os.path.dirname(file), exist_ok=True)
+		with open(file, 'w') as f:
+			json.dump(source.get(path), f, separators=(',', ':'))
+
+
+def record_fixtures(root, ids):
+
+	""" Records the live API payloads used by the app for the given FPL ids into fixture files under root. """
+	from pages import fpl_client, overall_utils
+
+	base_data = fpl_client.get_json('bootstrap-static/')
+	current_gw = overall_utils.current_gameweek(base_data)
+	paths = ['bootstrap-static/'] + [f'event/{gw}/live/' for gw in range(1, current_gw + 1)]
+	for id in ids:
+		paths += [f'entry/{id}/', f'entry/{id}/history/'] + [f'entry/{id}/event/{gw}/picks/' for gw in range(1, current_gw + 1)]
+
+	payloads = dict(zip(paths, fpl_client.get_many(paths, return_exceptions=True)))
+
+	for path, data in payloads.items():
+		if isinstance(data, Exception):
+			continue
+		file = fixture_file(root, path)
+		os.makedirs(os.path.dirname(file), exist_ok=True)
+		with open(file, 'w') as f:
+			json.dump(data, f, separators=(',', ':'))
+
+
+def synthetic_arguments(parser) -> None:
+	parser.add_argument('--managers', type=int, default=10)
+	parser.add_argument('--players', type=int, default=600)
+	parser.add_argument('--current-gw', type=int, default=N_GAMEWEEKS)
+	parser.add_argument('--seed', type=int, default=0)
+
+
+def synthetic_source(args):
+	return SyntheticSource(managers=args.managers, players=args.players, current_gw=args.current_gw, seed=args.seed)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Local stand-in for the FPL API.")
+	commands = parser.add_subparsers(dest='command', required=True)
+
+	serve = commands.add_parser('serve', help="serve fixtures or synthetic data over HTTP")
+	serve.add_argument('fixtures', nargs='?', help="directory of recorded fixtures")
+	serve.add_argument('--synthetic', action='store_true', help="serve synthetic data instead of fixtures")
+	serve.add_argument('--host', default='127.0.0.1')
+	serve.add_argument('--port', type=int, default=8765)
+	serve.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+	serve.add_argument('--jitter', type=float, default=0.0, help="maximum random seconds added on top of latency")
+	serve.add_argument('--error-rate', type=float, default=0.0, help="probability of answering with --error-status")
+	serve.add_argument('--error-status', type=int, default=500)
+	synthetic_arguments(serve)
+
+	generate = commands.add_parser('generate', help="write synthetic fixtures to a directory")
+	generate.add_argument('fixtures')
+	synthetic_arguments(generate)
+
+	record = commands.add_parser('record', help="record live API payloads for FPL ids to a directory")
+	record.add_argument('fixtures')
+	record.add_argument('--ids', type=int, nargs='+', required=True)
+
+	args = parser.parse_args()
+
+	if args.command == 'generate':
+		generate_fixtures(args.fixtures, synthetic_source(args))
+	elif args.command == 'record':
+		record_fixtures(args.fixtures, args.ids)
+	else:
+		if not args.synthetic and not args.fixtures:
+			parser.error("serve needs a fixtures directory or --synthetic")
+		source = synthetic_source(args) if args.synthetic else FixtureSource(args.fixtures)
+		server = ReplayServer(source, args.host, args.port, args.latency, args.jitter, args.error_rate, args.error_status, args.seed)
+		print(f"Serving FPL API stand-in at {server.url}")
+		server.serve_forever()
+
+
+if __name__ == '__main__':
+	main()
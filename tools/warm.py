@@ -0,0 +1,145 @@
+"""
+This file contains the batch job warming the caches ahead of traffic, meant to run right after each gameweek
+deadline. For a list of FPL ids and classic league ids it downloads every payload the pages need into the
+on-disk snapshot store, which every app process reads through, so the first visitors after a deadline are not
+the ones waiting on the API. No Streamlit session is needed.
+
+	python -m tools.warm --ids 132645 1 2 3
+	python -m tools.warm --ids-file ids.txt --processes 4 --threads 4
+	python -m tools.warm --leagues 314 --with-entries
+"""
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pages import fpl_client, snapshot_store, overall_utils, player_history, element_index, my_performance_utils, league_utils, metrics
+
+
+def season():
+
+	""" Returns the bootstrap data with the current and finished gameweek, loading every gameweek of the player panel. """
+	base_data = overall_utils.get_base_data()
+	current_gw, finished_gw = overall_utils.current_gameweek(base_data), overall_utils.finished_gameweek(base_data)
+	player_history.panel.update(current_gw, finished_gw)
+
+	return base_data, current_gw, finished_gw
+
+
+def warm_manager(id, base_data, current_gw, finished_gw) -> None:
+
+	""" Downloads a manager's details, history and picks the way My Performance reads them, going through every
+	gameweek result the page streams. """
+	index = element_index.element_index(base_data)
+	my_performance_utils.manager_info(id)
+	my_performance_utils.history_df(my_performance_utils.current_data(id, current_gw, finished_gw))
+	for _ in my_performance_utils.gameweek_results(id, current_gw, finished_gw, index):
+		pass
+
+
+def warm_league(id, base_data, current_gw, finished_gw):
+
+	""" Downloads a classic league's standings and the history and picks of its entries, and derives its
+	comparisons. Returns the FPL ids of its entries. """
+	league = league_utils.league_data(id, current_gw, finished_gw)
+	league.summary()
+
+	return league.standings['entry'].tolist()
+
+
+def http_requests():
+
+	""" Returns the number of HTTP requests this process has made to the FPL API. """
+	return sum(value for (name, _), value in metrics.registry.counters.items() if name == 'http_requests_total')
+
+
+def warm_batch(kind, ids, threads, rate=None):
+
+	""" Warms the managers or leagues given by ids on a pool of threads. Returns an (id, result, error) triple
+	for each, with error None on success, and the number of HTTP requests made. Runs in a worker process when
+	the job uses several, limited to its share rate of the requests per second. """
+	if rate is not None:
+		fpl_client.limiter.set_rate(rate)
+	requests = http_requests()
+	base_data, current_gw, finished_gw = season()
+	warm = warm_manager if kind == 'manager' else warm_league
+
+	def warm_one(id):
+		try:
+			return id, warm(id, base_data, current_gw, finished_gw), None
+		except fpl_client.FPLAPIError as e:
+			return id, None, str(e)
+
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+		results = list(pool.map(warm_one, ids))
+
+	return results, http_requests() - requests
+
+
+def run(kind, ids, processes, threads):
+
+	""" Warms ids split into one batch per process, or in this process if processes is 1. Returns the result of
+	every id and the number of HTTP requests made. """
+	if processes <= 1:
+		return warm_batch(kind, ids, threads)
+
+	batches = [ids[i::processes] for i in range(processes) if ids[i::processes]]
+	with ProcessPoolExecutor(max_workers=len(batches)) as pool:
+		done = list(pool.map(warm_batch, [kind] * len(batches), batches, [threads] * len(batches),
+			[fpl_client.MAX_RPS / len(batches)] * len(batches)))
+
+	return [result for results, _ in done for result in results], sum(requests for _, requests in done)
+
+
+def report(kind, results, requests, seconds) -> int:
+
+	""" Prints a summary of a warm run and every failure, and returns the number of failures. """
+	failures = [(id, error) for id, _, error in results if error is not None]
+	print(f"Warmed {len(results) - len(failures)}/{len(results)} {kind}s in {seconds:.1f}s with {requests:g} HTTP requests")
+	for id, error in failures:
+		print(f"  {kind} {id}: {error}")
+
+	return len(failures)
+
+
+def read_ids(path):
+	with open(path) as f:
+		return [int(token) for token in f.read().split()]
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Warm the snapshot store and caches for FPL ids and classic leagues.")
+	parser.add_argument('--ids', type=int, nargs='*', default=[], help="FPL ids of managers")
+	parser.add_argument('--ids-file', help="file of whitespace-separated FPL ids")
+	parser.add_argument('--leagues', type=int, nargs='*', default=[], help="classic league ids")
+	parser.add_argument('--with-entries', action='store_true', help="also warm My Performance for every entry of the leagues")
+	parser.add_argument('--processes', type=int, default=1, help="worker processes sharing the snapshot store")
+	parser.add_argument('--threads', type=int, default=4, help="managers or leagues warmed concurrently in each process")
+	args = parser.parse_args()
+
+	ids = args.ids + (read_ids(args.ids_file) if args.ids_file else [])
+	if not ids and not args.leagues:
+		parser.error("give --ids, --ids-file or --leagues")
+	if snapshot_store.store is None and args.processes > 1:
+		parser.error("several processes only share their work through the snapshot store; set FPL_SNAPSHOT_DB")
+
+	if snapshot_store.store is not None:
+		print(f"Purged {snapshot_store.store.purge_expired()} expired snapshots")
+
+	failures = 0
+	start = time.perf_counter()
+	if args.leagues:
+		results, requests = run('league', args.leagues, args.processes, args.threads)
+		failures += report('league', results, requests, time.perf_counter() - start)
+		if args.with_entries:
+			ids += [entry for _, entries, _ in results if entries for entry in entries]
+
+	if ids:
+		start = time.perf_counter()
+		results, requests = run('manager', list(dict.fromkeys(ids)), args.processes, args.threads)
+		failures += report('manager', results, requests, time.perf_counter() - start)
+
+	sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+	main()